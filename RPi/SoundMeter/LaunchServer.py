@@ -1,9 +1,14 @@
 import os
+import signal
 import subprocess
-from flask import Flask, send_from_directory, abort, redirect, url_for
-import struct
+import threading
+import queue
+from flask import Flask, Response, send_from_directory, abort, redirect, url_for
 import json 
 import time 
+import measure_format
+import live_frame
+import metrics
 
 app = Flask(__name__)
 DOSSIER = "/home/acoustic/Documents/Mesures"
@@ -13,6 +18,8 @@ SCRIPT_TEMPERATURE = "/home/acoustic/Documents/Mesures/ReadTempHumid.py"
 PID_FILE = "/home/acoustic/Documents/Mesures/mesure.pid"
 SCRIPT_CALIB = "/home/acoustic/Documents/Mesures/calibration_seule.py"
 
+LIVE = live_frame.LiveFrameReader()
+
 @app.route("/")
 def index():
     # Grab calibration file and display its properties 
@@ -62,7 +69,8 @@ def index():
         files = os.listdir(MEASURES)
         bin_files = [f for f in files if f.endswith(".bin") and os.path.isfile(os.path.join(MEASURES, f))]
         csv_files = [f for f in files if f.endswith(".csv") and os.path.isfile(os.path.join(MEASURES, f))]
-        files = bin_files + csv_files
+        archive_files = [f for f in files if f.endswith(".sma") and os.path.isfile(os.path.join(MEASURES, f))]
+        files = archive_files + bin_files + csv_files
 
 
     except Exception as e:
@@ -71,27 +79,56 @@ def index():
     spl_value = "<p><strong>Last measurement unavailable.</strong></p>"
     if bin_files:
         try:
-            spl_value = "<p><strong>Current LAeq,1s :</strong> <span id='spl'>--</span> dB(A)</p>"
+            spl_value = """<p><strong>Current LAeq,1s :</strong> <span id='spl'>--</span> dB(A)</p>
+            <canvas id="spectrum" width="640" height="220"></canvas>"""
         except Exception as e:
             spl_value = f"<p>Error reading LAeq from binary : {e}</p>"
 
     spl_script = """
     <script>
+    function setSPL(text) {
+        const el = document.getElementById('spl');
+        if (el) el.textContent = text;
+    }
+    function drawSpectrum(bands) {
+        const canvas = document.getElementById('spectrum');
+        if (!canvas || !bands) return;
+        const ctx = canvas.getContext('2d');
+        const names = Object.keys(bands).sort((a, b) => parseFloat(a) - parseFloat(b));
+        const w = canvas.width / names.length, h = canvas.height - 20, top = 120;
+        ctx.clearRect(0, 0, canvas.width, canvas.height);
+        names.forEach((name, i) => {
+            const level = bands[name];
+            const bar = level === null ? 0 : Math.max(0, Math.min(1, level / top)) * h;
+            ctx.fillStyle = '#1c7ec5';
+            ctx.fillRect(i * w + 1, h - bar, w - 2, bar);
+            if (i % 3 === 0) {
+                ctx.fillStyle = '#333';
+                ctx.font = '9px Arial';
+                ctx.fillText(name.replace('Hz', ''), i * w, canvas.height - 5);
+            }
+        });
+    }
+    function showFrame(j) {
+        setSPL(j.spl !== null ? j.spl.toFixed(1) : 'N.A.');
+        drawSpectrum(j.bands);
+    }
     async function updateSPL() {
         try {
             const resp = await fetch('/spl', {cache: 'no-store'});
-            const j = await resp.json();
-            if (j.spl !== null) {
-                document.getElementById('spl').textContent = j.spl.toFixed(1);
-            } else {
-                document.getElementById('spl').textContent = 'N.A.';
-            }
+            showFrame(await resp.json());
         } catch {
-            document.getElementById('spl').textContent = 'N.A.';
+            setSPL('N.A.');
         }
     }
     updateSPL();
-    setInterval(updateSPL, 3000);
+    if (window.EventSource) {
+        // Pushed by the server at every new record, see /stream
+        const source = new EventSource('/stream');
+        source.onmessage = (e) => showFrame(JSON.parse(e.data));
+    } else {
+        setInterval(updateSPL, 3000);
+    }
     </script>
     """
 
@@ -145,38 +182,127 @@ def envi():
     except Exception:
         return {"temperature_c": None, "humidity_pct": None}
 
+def frame_to_json(frame):
+    values = {k: (None if v != v else v) for k, v in frame["values"].items()}   # NaN is not valid JSON
+    return {
+        "spl": values.get("LAeq"),
+        "message": None,
+        "seq": frame["seq"],
+        "timestamp": frame["timestamp"],
+        "bands": {k: v for k, v in values.items() if k.endswith("Hz")},
+        "SPL_A": values.get("SPL_A"),
+        "SPL_C": values.get("SPL_C"),
+        "SPL_Z": values.get("SPL_Z"),
+    }
+
 @app.route("/spl")
 def spl():
+    # Served from the shared-memory frame published by measure.py
+    frame = LIVE.read()
+    if frame is not None:
+        return frame_to_json(frame)
+
+    # No live frame (measure.py not running yet): last record on disk
     try:
         files = os.listdir(MEASURES)
-        bin_files = [f for f in files if f.endswith(".bin")]
+        # Extra channels (mesures_chN_*) and the rollup sidecars are not shown on the live value
+        bin_files = [f for f in files if f.endswith(".bin") and f.startswith("mesures_") and not f.startswith("mesures_ch")]
         if not bin_files:
             return {"spl": None, "message": "Last measurement unavailable."}
 
         latest_bin = max(bin_files, key=lambda f: os.path.getmtime(os.path.join(MEASURES, f)))
         bin_path = os.path.join(MEASURES, latest_bin)
 
-        input_size = 1 + 31 + 3
-        bytes_size = input_size * 2
-
-        os.sync()
-        with open(bin_path, "rb") as f:
-            f.seek(0, os.SEEK_END)
-            file_size = f.tell()
-            if file_size < bytes_size:
-                return {"spl": None, "message": "File too short to extract LAeq."}
-
-            f.seek(-bytes_size, os.SEEK_END)
-            bloc = f.read(bytes_size)
-            values = struct.unpack(f"{input_size}h", bloc)
+        metadata, record = measure_format.read_last_record(bin_path)
+        if record is None:
+            return {"spl": None, "message": "File too short to extract LAeq."}
 
-        LAeq_brut = values[0]
-        LAeq = round(LAeq_brut / 10, 1)
+        LAeq_brut = record["values"][metadata["columns"].index("LAeq")]
+        LAeq = round(LAeq_brut / metadata.get("scale", measure_format.SCALE), 1)
         return {"spl": LAeq, "message": None}
 
     except Exception as e:
         return {"spl": None, "message": f"Error: {e}"}
       
+class FrameBroadcaster:
+    """
+    One poller on the live frame fanned out to every /stream client.
+    Each frame is serialised once; every client has a small bounded queue and
+    a slow client only loses its own oldest frames. The poller runs only
+    while someone is connected.
+    """
+
+    def __init__(self, reader, interval=0.1, client_queue=16):
+        self.reader = reader
+        self.interval = interval
+        self.client_queue = client_queue
+        self.clients = set()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.last_seq = None
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self.client_queue)
+        with self.lock:
+            self.clients.add(q)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="broadcaster", daemon=True)
+                self.thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.clients.discard(q)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.clients:
+                    self.thread = None
+                    return
+                clients = list(self.clients)
+            frame = self.reader.read()
+            if frame is not None and frame["seq"] != self.last_seq:
+                self.last_seq = frame["seq"]
+                message = f"id: {frame['seq']}\ndata: {json.dumps(frame_to_json(frame))}\n\n"
+                for q in clients:
+                    try:
+                        q.put_nowait(message)
+                    except queue.Full:
+                        try:
+                            q.get_nowait()
+                            q.put_nowait(message)
+                        except (queue.Empty, queue.Full):
+                            pass
+            time.sleep(self.interval)
+
+BROADCASTER = FrameBroadcaster(LIVE)
+
+@app.route("/stream")
+def stream():
+    # Server-sent events: one message per new record of the running measurement
+    q = BROADCASTER.subscribe()
+
+    def events():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    yield q.get(timeout=15)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            BROADCASTER.unsubscribe(q)
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/metrics")
+def prometheus_metrics():
+    # Statistics published once per second by measure.py, see metrics.py
+    text = metrics.render_prometheus(metrics.read_stats())
+    return Response(text, mimetype="text/plain; version=0.0.4")
+
 @app.route("/start")
 def start_script():
     if os.path.exists(PID_FILE):
@@ -187,6 +313,29 @@ def start_script():
         f.write(str(p.pid))
     return redirect(url_for('index'))
 
+def stop_process(pid, timeout=5.0):
+    # SIGTERM lets measure.py flush its files; SIGKILL only if it does not exit in time
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                return
+        except ChildProcessError:
+            # Not started by this server: just check whether it is still there
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                return
+        time.sleep(0.1)
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
 @app.route("/stop")
 def stop_script():
     if not os.path.exists(PID_FILE):
@@ -194,10 +343,7 @@ def stop_script():
 
     with open(PID_FILE, "r") as f:
         pid = int(f.read())
-    try:
-        os.kill(pid, 9)
-    except ProcessLookupError:
-        pass
+    stop_process(pid)
     os.remove(PID_FILE)
     return redirect(url_for('index'))
 
@@ -207,4 +353,4 @@ def recalibrate():
     return redirect(url_for('index'))
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8080)
\ No newline at end of file
+    app.run(host="0.0.0.0", port=8080, threaded=True)
\ No newline at end of file
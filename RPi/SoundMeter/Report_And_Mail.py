@@ -1,20 +1,26 @@
+# Heavy dependencies (pandas, matplotlib, email/smtplib) are imported in the
+# functions that use them, and importing this module has no side effects,
+# so the cron job and the backfill only pay for what they run. The import
+# time is checked by check_import_time.py.
+
+from __future__ import annotations
+
 import os
 import glob
-import ssl
-import smtplib
+import csv
+import argparse
 import json
+import warnings
+from functools import lru_cache
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from matplotlib.dates import DateFormatter
-from email.message import EmailMessage
-from email.utils import formatdate, make_msgid
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.image import MIMEImage
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from typing import List, Dict, Any, TYPE_CHECKING
+import measure_reader
+import level_stats
+import assessment
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 # ----------------------------
 # Configuration
@@ -22,12 +28,18 @@ from typing import List, Dict, Any
 DOSSIER = "/home/acoustic/Documents/Mesures"
 DOSS_CSV = os.path.join(DOSSIER, "measurements")
 PLOT_DIR = os.path.join(DOSSIER, "reports")
-os.makedirs(PLOT_DIR, exist_ok=True)
 
 PROJECT_CONFIG = "/home/acoustic/Documents/Mesures/PROJECT_CONFIG.json"  # JSON config path
 ROLL_SEC = 300  # L90,5min window size (seconds)
 
-plt.style.use("seaborn-v0_8")
+@lru_cache(maxsize=None)
+def _pyplot():
+    """pyplot on the headless Agg backend, with the report style; loaded on first use."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    plt.style.use("seaborn-v0_8")
+    return plt
 
 # ----------------------------
 # Load config from JSON
@@ -51,14 +63,18 @@ def load_config(path=PROJECT_CONFIG):
         {"name":"day","start":7,"end":19,"limit":55.0},
         {"name":"evening","start":19,"end":23,"limit":50.0},
         {"name":"night","start":23,"end":7,"limit":45.0}
-      ]
-    }"""
+      ],
+      "weekday_periods": {"sunday": [...]},     (optional)
+      "holidays": ["2025-12-25"],               (optional, see assessment.py)
+      "holiday_periods": [...]                  (optional)
+    }
+    The periods are returned compiled as an assessment.PeriodSchedule."""
 
     with open(path,"r") as fh:
         cfg = json.load(fh)
     smtp = cfg["smtp"]
     rec = cfg["recipients"]
-    periods = cfg.get("periods", [])
+    periods = assessment.PeriodSchedule.from_config(cfg)
     return smtp["user"], smtp["pass"], rec["to"], rec.get("cc",[]), rec.get("bcc",[]), periods
 
 # ----------------------------
@@ -68,6 +84,42 @@ def discover_day_csvs(base_dir: str, target_date: datetime.date) -> List[str]:
     ymd = target_date.strftime("%Y-%m-%d")
     return sorted(glob.glob(os.path.join(base_dir, f"mesures_{ymd}_*.csv")))
 
+def load_day_from_bin(base_dir: str, target_date: datetime.date):
+    """
+    Load one day from the hourly .bin files, same returns as load_day_from_csv.
+    Records are placed on the 1-second grid by index instead of resample():
+    like the CSV path, the first record of each second is kept and seconds
+    without a record are NaN. Returns None when there is no .bin data.
+    """
+    import pandas as pd
+
+    series = measure_reader.MeasurementReader(base_dir).day(target_date)
+    if not len(series):
+        return None
+    seconds = np.floor(series.timestamps).astype(np.int64)
+    order = np.argsort(seconds, kind="stable")
+    first = order[np.unique(seconds[order], return_index=True)[1]]
+    values = series.columns_block(["LAeq"] + series.band_columns)[first]
+    t0 = seconds[first[0]]
+    idx = seconds[first] - t0
+    n = int(idx[-1]) + 1
+
+    grid = np.full((n, values.shape[1]), np.nan)
+    grid[idx] = values
+
+    times = pd.date_range(datetime.fromtimestamp(t0), periods=n, freq="1s")
+    return times, grid[:, 0], series.freqs_hz, grid[:, 1:]
+
+def load_day(base_dir: str, target_date: datetime.date):
+    """Binary files first, the hourly CSVs only when there is no .bin data for the day."""
+    loaded = load_day_from_bin(base_dir, target_date)
+    if loaded is not None:
+        return loaded
+    csv_files = discover_day_csvs(base_dir, target_date)
+    if not csv_files:
+        raise FileNotFoundError(f"No measurements found for {target_date.isoformat()} under {base_dir}")
+    return load_day_from_csv(csv_files)
+
 def load_day_from_csv(csv_files: List[str]):
     """
     Load and concatenate one day's CSVs. 
@@ -77,6 +129,8 @@ def load_day_from_csv(csv_files: List[str]):
       freqs_hz   : numpy array (float sorted)
       S_db       : 2D numpy array [n_times, n_bins]
     """
+    import pandas as pd
+
     frames = []
     for f in csv_files:
         try:
@@ -133,6 +187,7 @@ def load_day_from_csv(csv_files: List[str]):
 
     # Save to PLOT_DIR
     tag = day_df.index[0].date().strftime("%Y%m%d") if len(day_df) else "empty"
+    os.makedirs(PLOT_DIR, exist_ok=True)
     out_path = os.path.join(PLOT_DIR, f"dayfile_{tag}.csv")
     out_df.to_csv(out_path, index=False)
 
@@ -142,19 +197,29 @@ def load_day_from_csv(csv_files: List[str]):
 # Computations for reporting
 
 def energy_average_LAeq(values_db: np.ndarray) -> float:
-    """LAeq = 10*log10(mean(10^(L/10)))"""
+    """LAeq = 10*log10(mean(10^(L/10))), missing seconds (NaN) ignored"""
+    values_db = values_db[~np.isnan(values_db)]
     return float(10.0 * np.log10(np.mean(10.0 ** (values_db / 10.0)))) if len(values_db) else np.nan
 
 def compute_L90_day(laeq_1s: np.ndarray) -> float:
-    """L90,day = 10th percentile of LAeq,1s (level exceeded 90% of time)."""
-    return float(np.percentile(laeq_1s, 10)) if len(laeq_1s) else np.nan
+    """L90,day = 10th percentile of LAeq,1s (level exceeded 90% of time), missing seconds ignored."""
+    return level_stats.percentile(laeq_1s, 10) if len(laeq_1s) else np.nan
+
+def compute_Ln_day(laeq_1s: np.ndarray) -> Dict[str, float]:
+    """L5, L10, L50, L90, L95 of LAeq,1s."""
+    return level_stats.ln_levels(laeq_1s)
 
 def compute_L90_rolling(times: pd.DatetimeIndex, laeq_1s: np.ndarray, roll_sec: int = ROLL_SEC) -> pd.Series:
     """Rolling L90 over roll_sec seconds (centered)."""
+    import pandas as pd
+
     if len(laeq_1s) == 0:
         return pd.Series([], index=times)
-    s = pd.Series(laeq_1s, index=times)
-    return s.rolling(f'{roll_sec}s', center=True).quantile(0.10)
+    if level_stats.quantize(laeq_1s[~np.isnan(laeq_1s)]) is None:
+        s = pd.Series(laeq_1s, index=times)
+        return s.rolling(f'{roll_sec}s', center=True).quantile(0.10)
+    seconds = np.asarray((times - times[0]) / pd.Timedelta(seconds=1))
+    return pd.Series(level_stats.rolling_percentile(seconds, laeq_1s, roll_sec, 10), index=times)
 
 # ----------------------------
 # Dynamic limit line (one moving line)
@@ -173,8 +238,11 @@ def classify_period(h: int, periods: List[Dict[str, Any]]) -> Dict[str, Any]:
                 return p
     return periods[0]  # fallback
 
-def dynamic_limit_series(times: pd.DatetimeIndex, periods: List[Dict[str, Any]]) -> np.ndarray:
-    return np.array([classify_period(t.hour, periods)['limit'] for t in times], dtype=float)
+def dynamic_limit_series(times: pd.DatetimeIndex, periods) -> np.ndarray:
+    """Limit in force at each time; periods is a PeriodSchedule or a list of periods."""
+    if not isinstance(periods, assessment.PeriodSchedule):
+        periods = assessment.PeriodSchedule(periods)
+    return periods.limit_series(times)
 
 # ----------------------------
 # Exceedances
@@ -194,17 +262,94 @@ def compute_exceedances_dynamic(times: pd.DatetimeIndex, laeq_1s: np.ndarray, li
 
 # ----------------------------
 # Plots
+#
+# A day holds 86,400 points for a figure about 1,800 pixels wide, so the
+# data are reduced to the pixel columns of the figure before drawing: the
+# level curves keep the min and max of each column (the same pixels are
+# lit), the spectrogram keeps the energy average of each column. The figures
+# are drawn once and saved as 256-colour PNGs (see save_png).
+
+def save_png(fig, out_path, dpi):
+    """
+    Draw the figure once and save it as a 256-colour PNG: the plots use few
+    colours (the colormap has 256), the palette is indistinguishable from
+    the full render and the files are two to three times smaller.
+    """
+    from PIL import Image
+
+    fig.set_dpi(dpi)
+    fig.canvas.draw()
+    rgb = np.asarray(fig.canvas.buffer_rgba())[..., :3]
+    image = Image.fromarray(rgb).quantize(256, method=Image.Quantize.MAXCOVERAGE, dither=Image.Dither.NONE)
+    image.save(out_path, dpi=(dpi, dpi))
+
+def band_edges(freqs_hz):
+    """Edges of the third-octave bands: geometric means of neighbouring centres."""
+    freqs_hz = np.asarray(freqs_hz, dtype=float)
+    if len(freqs_hz) < 2:
+        return np.concatenate([freqs_hz * 2 ** (-1 / 6), freqs_hz * 2 ** (1 / 6)])
+    inner = np.sqrt(freqs_hz[:-1] * freqs_hz[1:])
+    return np.concatenate([[freqs_hz[0] ** 2 / inner[0]], inner, [freqs_hz[-1] ** 2 / inner[-1]]])
+
+def pixel_columns(fig, ax):
+    """Width in pixels of the plotting area."""
+    return max(1, int(round(ax.get_position().width * fig.get_figwidth() * fig.dpi)))
+
+def minmax_envelope(times, values, n_bins):
+    """
+    (x, y) of a line going through the min and max of each of n_bins time
+    bins; bins without data give NaN, so gaps stay visible.
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if n <= 2 * n_bins:
+        return times, values
+    per = -(-n // n_bins)
+    n_bins = -(-n // per)
+    padded = np.full(n_bins * per, np.nan)
+    padded[:n] = values
+    padded = padded.reshape(n_bins, per)
+    with np.errstate(invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        lo = np.nanmin(padded, axis=1)
+        hi = np.nanmax(padded, axis=1)
+    first = np.asarray(times[::per])
+    x = np.repeat(first, 2)
+    y = np.column_stack([lo, hi]).ravel()
+    return x, y
+
+def energy_bins(S_db, n_bins):
+    """Energy average of S_db rows in n_bins consecutive time bins (NaN ignored); returns (S, per)."""
+    n = len(S_db)
+    per = max(1, -(-n // n_bins))
+    n_bins = -(-n // per)
+    padded = np.full((n_bins * per, S_db.shape[1]), np.nan)
+    padded[:n] = S_db
+    energy = 10.0 ** (padded.reshape(n_bins, per, -1) / 10.0)
+    with np.errstate(divide="ignore", invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return 10.0 * np.log10(np.nanmean(energy, axis=1)), per
 
 def plot_levels(times, laeq_1s, l90_5min, l90_day, limit_series, out_path):
+    plt = _pyplot()
+    import matplotlib.dates as mdates
+    from matplotlib.dates import DateFormatter
+
     fig, ax = plt.subplots(figsize=(12, 4))
-    ax.plot(times, laeq_1s, color="#1c7ec5", lw=1.1, label="LAeq,1s")
+    fig.set_dpi(150)
+    # Envelopes sized on the axes before layout, resampled once the plotting area is final
+    n_bins = pixel_columns(fig, ax)
+    envelopes = [(times, laeq_1s)]
+    ax.plot(*minmax_envelope(times, laeq_1s, n_bins), color="#1c7ec5", lw=1.1, label="LAeq,1s")
     l90_5 = l90_5min.dropna()
     if len(l90_5) > 0:
-        ax.plot(l90_5.index, l90_5.values, color="#2ca02c", lw=1.4, label="L90,5min")
+        envelopes.append((l90_5.index, l90_5.values))
+        ax.plot(*minmax_envelope(l90_5.index, l90_5.values, n_bins), color="#2ca02c", lw=1.4, label="L90,5min")
     if not np.isnan(l90_day):
         ax.hlines(l90_day, xmin=times[0], xmax=times[-1], colors="#ff7f0e",
                   linestyles="--", label=f"L90,day = {l90_day:.1f} dB(A)")
-    ax.plot(times, limit_series, color="#d62728", linestyle=":", lw=1.5, label="Legal limit")
+    envelopes.append((times, limit_series))
+    ax.plot(*minmax_envelope(times, limit_series, n_bins), color="#d62728", linestyle=":", lw=1.5, label="Legal limit")
     ax.set_title("Daily sound levels — LAeq,1s + L90,5min + L90,day + dynamic limit")
     ax.set_ylabel("Level [dB(A)]")
     ax.set_xlabel("Time")
@@ -214,27 +359,35 @@ def plot_levels(times, laeq_1s, l90_5min, l90_day, limit_series, out_path):
     ax.xaxis.set_major_locator(mdates.HourLocator(interval=2))
     fig.autofmt_xdate()
     fig.tight_layout()
-    fig.savefig(out_path, dpi=150)
+
+    n_bins = pixel_columns(fig, ax)
+    for line, (x, y) in zip(ax.get_lines(), envelopes):
+        line.set_data(*minmax_envelope(x, y, n_bins))
+    save_png(fig, out_path, 150)
     plt.close(fig)
 
 
 def plot_spectrogram(times, freqs_hz, S_db, out_path):
+    plt = _pyplot()
+    import matplotlib.dates as mdates
+    from matplotlib.dates import DateFormatter
+    from matplotlib.colors import Normalize
 
     if S_db.size == 0 or len(times) == 0:
         return False
 
-    # Convert times to matplotlib numbers
+    fig, ax = plt.subplots(figsize=(12, 5))
+    fig.set_dpi(180)
     t_nums = mdates.date2num(times)
     dt = (t_nums[1] - t_nums[0]) if len(t_nums) > 1 else 1/(24*3600)
-    t_edges = np.concatenate([t_nums - dt/2, [t_nums[-1] + dt/2]])
+    f_edges = band_edges(freqs_hz)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        norm = Normalize(np.nanmin(S_db), np.nanmax(S_db))
 
-    # Frequency edges
-    df = np.diff(freqs_hz).mean() if len(freqs_hz) > 1 else 1.0
-    f_edges = np.concatenate([freqs_hz - df/2, [freqs_hz[-1] + df/2]])
-
-    # Plot
-    fig, ax = plt.subplots(figsize=(12, 5))
-    mesh = ax.pcolormesh(t_edges, f_edges, S_db.T, shading="auto", cmap="plasma")
+    # Placeholder for the colorbar and the layout, replaced by the binned data below
+    mesh = ax.pcolormesh([t_nums[0] - dt/2, t_nums[-1] + dt/2], f_edges, np.full((len(freqs_hz), 1), np.nan),
+                         cmap="plasma", norm=norm)
 
     # Colorbar
     cbar = fig.colorbar(mesh, ax=ax, pad=0.02)
@@ -251,7 +404,14 @@ def plot_spectrogram(times, freqs_hz, S_db, out_path):
     ax.grid(True, which="both", linestyle="--", alpha=0.3)
 
     fig.tight_layout()
-    fig.savefig(out_path, dpi=180)
+
+    # Energy average per pixel column of the final plotting area
+    S_binned, per = energy_bins(S_db, pixel_columns(fig, ax))
+    t_edges = np.minimum(t_nums[0] - dt/2 + np.arange(len(S_binned) + 1) * per * dt, t_nums[-1] + dt/2)
+    mesh.remove()
+    ax.pcolormesh(t_edges, f_edges, S_binned.T, cmap="plasma", norm=norm)
+
+    save_png(fig, out_path, 180)
     plt.close(fig)
     return True
 
@@ -259,6 +419,11 @@ def plot_spectrogram(times, freqs_hz, S_db, out_path):
 # Email (inline images via attachments with CID)
 
 def send_email(user, passwd, subject, metrics, inline_images, to_list, cc_list, bcc_list):
+    import ssl
+    import smtplib
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    from email.mime.image import MIMEImage
 
     root = MIMEMultipart('mixed')
     root['From'] = user
@@ -279,6 +444,15 @@ def send_email(user, passwd, subject, metrics, inline_images, to_list, cc_list,
         "<p style='color:#2ca02c;'>No exceedance above dynamic limit detected.</p>"
     )
 
+    period_rows = "".join(
+        f"<tr><td>LAeq,{name}</td><td>{p['laeq']:.1f} dB(A) — above limit {p['n_exceed']} s ({p['pct_time']:.1f}%)</td></tr>"
+        for name, p in metrics.get('periods', {}).items() if p['n']
+    )
+    lden_rows = "".join(
+        f"<tr><td>{name}</td><td>{value:.1f} dB(A)</td></tr>"
+        for name, value in metrics.get('lden', {}).items() if not np.isnan(value)
+    )
+
     html_body = f"""
     <html>
     <body style="font-family:Arial, sans-serif; color:#333;">
@@ -287,6 +461,9 @@ def send_email(user, passwd, subject, metrics, inline_images, to_list, cc_list,
         <tr><th>Metric</th><th>Value</th></tr>
         <tr><td>LAeq,day</td><td>{metrics['laeq_day']:.1f} dB(A)</td></tr>
         <tr><td>L90,day</td><td>{metrics['l90_day']:.1f} dB(A)</td></tr>
+        {period_rows}
+        {lden_rows}
+        <tr><td>L5 / L10 / L50 / L95</td><td>{metrics['ln']['L5']:.1f} / {metrics['ln']['L10']:.1f} / {metrics['ln']['L50']:.1f} / {metrics['ln']['L95']:.1f} dB(A)</td></tr>
       </table>
       {exceed_html}
       <h3>Day Levels</h3>
@@ -325,31 +502,23 @@ def send_email(user, passwd, subject, metrics, inline_images, to_list, cc_list,
 # ----------------------------
 # Orchestration
 
-def generate_and_send_daily_report(config_path=PROJECT_CONFIG, target_date=None):
-    # Load everything from JSON
-    user, passwd, to_list, cc_list, bcc_list, periods = load_config(PROJECT_CONFIG)
-
-    # Default to yesterday
-    if target_date is None:
-        today = datetime.now().date()
-        target_date = today - timedelta(days=1)
-
-    # Find CSVs
-    csv_files = discover_day_csvs(DOSS_CSV, target_date)
-    if not csv_files:
-        raise FileNotFoundError(f"No CSVs found for {target_date.isoformat()} under {DOSS_CSV}")
-
-    # Load data
-    times, laeq_1s, freqs_hz, S_db = load_day_from_csv(csv_files)
+def build_daily_report(target_date, periods, base_dir=DOSS_CSV):
+    """Plots and metrics of one day; returns (metrics, inline_images)."""
+    # Load data (.bin files, CSVs as fallback)
+    times, laeq_1s, freqs_hz, S_db = load_day(base_dir, target_date)
     laeq_daily = energy_average_LAeq(laeq_1s)
     l90_day    = compute_L90_day(laeq_1s)
+    ln_day     = compute_Ln_day(laeq_1s)
     l90_5min   = compute_L90_rolling(times, laeq_1s, ROLL_SEC)
     limit_line = dynamic_limit_series(times, periods)
     ex_all     = compute_exceedances_dynamic(times, laeq_1s, limit_line)
+    by_period  = assessment.period_levels(times, laeq_1s, periods)
+    lden       = assessment.lden_levels(times, laeq_1s, periods)
 
     #print(f"Daily LAeq : {laeq_daily:.1f} dB(A), L90,day: {l90_day:.1f} dB(A)")
 
     # Plots
+    os.makedirs(PLOT_DIR, exist_ok=True)
     tag = target_date.strftime("%Y%m%d")
     levels_png  = os.path.join(PLOT_DIR, f"levels_dynamic_{tag}.png")
     spectro_png = os.path.join(PLOT_DIR, f"spectrogram_{tag}.png")
@@ -365,8 +534,23 @@ def generate_and_send_daily_report(config_path=PROJECT_CONFIG, target_date=None)
     metrics = {
         "laeq_day": laeq_daily,
         "l90_day": l90_day,
-        "exceed_info": ex_all
+        "ln": ln_day,
+        "exceed_info": ex_all,
+        "periods": by_period,
+        "lden": lden,
     }
+    return metrics, inline_images
+
+def generate_and_send_daily_report(config_path=PROJECT_CONFIG, target_date=None):
+    # Load everything from JSON
+    user, passwd, to_list, cc_list, bcc_list, periods = load_config(config_path)
+
+    # Default to yesterday
+    if target_date is None:
+        today = datetime.now().date()
+        target_date = today - timedelta(days=1)
+
+    metrics, inline_images = build_daily_report(target_date, periods)
 
     # Subject line
     subject = f"Daily noise report — {target_date.isoformat()}"
@@ -374,9 +558,111 @@ def generate_and_send_daily_report(config_path=PROJECT_CONFIG, target_date=None)
     # Send email
     send_email(user, passwd, subject, metrics, inline_images, to_list, cc_list, bcc_list)
 
+# ----------------------------
+# Backfill (several days, no email)
+
+def day_inputs_signature(base_dir, target_date, config_path=PROJECT_CONFIG):
+    """Name, size and mtime of the day's measurement files and of the config."""
+    ymd = target_date.strftime("%Y-%m-%d")
+    paths = sorted(glob.glob(os.path.join(base_dir, f"mesures_{ymd}[_.]*"))) + [config_path]
+    signature = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        signature.append([os.path.basename(path), st.st_size, st.st_mtime_ns])
+    return signature
+
+def report_day(target_date, config_path=PROJECT_CONFIG, base_dir=DOSS_CSV, force=False):
+    """
+    Build one day's report without sending it, cached in PLOT_DIR/metrics_<date>.json.
+    Returns the metrics, or None if the day has no measurements.
+    """
+    if isinstance(target_date, str):
+        target_date = datetime.strptime(target_date, "%Y-%m-%d").date()
+    tag = target_date.strftime("%Y%m%d")
+    cache_path = os.path.join(PLOT_DIR, f"metrics_{tag}.json")
+    signature = day_inputs_signature(base_dir, target_date, config_path)
 
-def main():
-    generate_and_send_daily_report(target_date=None)
+    if not force and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r") as fh:
+                cached = json.load(fh)
+            if cached["signature"] == signature and all(os.path.exists(i["path"]) for i in cached["images"]):
+                return cached["metrics"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    with open(config_path, "r") as fh:
+        periods = assessment.PeriodSchedule.from_config(json.load(fh))
+    try:
+        metrics, inline_images = build_daily_report(target_date, periods, base_dir)
+    except FileNotFoundError:
+        return None
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w") as fh:
+        json.dump({"date": target_date.isoformat(), "signature": signature,
+                   "metrics": metrics, "images": inline_images}, fh)
+    os.replace(tmp_path, cache_path)
+    return metrics
+
+def backfill_reports(first_day, last_day, workers=None, config_path=PROJECT_CONFIG,
+                     base_dir=DOSS_CSV, force=False, summary_path=None):
+    """
+    Reports of every day from first_day to last_day (included) over a process
+    pool, days whose inputs did not change since the last run are read from
+    the cache. Returns {date: metrics}; optionally writes a summary CSV.
+    """
+    days = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+    results = {}
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {day: pool.submit(report_day, day.isoformat(), config_path, base_dir, force) for day in days}
+        for day, future in futures.items():
+            try:
+                results[day] = future.result()
+            except Exception as e:
+                print(f"{day.isoformat()} : error : {e}")
+                results[day] = None
+                continue
+            if results[day] is None:
+                print(f"{day.isoformat()} : no measurements")
+            else:
+                print(f"{day.isoformat()} : LAeq {results[day]['laeq_day']:.1f} dB(A)")
+
+    if summary_path:
+        lden_names = ["Lden", "Ldn", "Lday", "Levening", "Lnight"]
+        ln_names = ["L5", "L10", "L50", "L90", "L95"]
+        with open(summary_path, "w", newline="") as fh:
+            writer = csv.writer(fh)
+            writer.writerow(["date", "LAeq"] + ln_names + lden_names + ["exceed_s", "exceed_pct"])
+            for day, m in results.items():
+                if m is None:
+                    continue
+                writer.writerow([day.isoformat(), f"{m['laeq_day']:.1f}"]
+                                + [f"{m['ln'][n]:.1f}" for n in ln_names]
+                                + [f"{m['lden'][n]:.1f}" for n in lden_names]
+                                + [m['exceed_info']['n_exceed'], f"{m['exceed_info']['pct_time']:.1f}"])
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Daily noise report. Without --from, yesterday's report is emailed.")
+    parser.add_argument("--from", dest="first", help="first day to backfill (YYYY-mm-dd), no email is sent")
+    parser.add_argument("--to", dest="last", help="last day to backfill (default: --from)")
+    parser.add_argument("--workers", type=int, default=None, help="processes for the backfill (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="ignore the per-day cache")
+    parser.add_argument("--summary", help="CSV file for the per-day summary of the backfill")
+    parser.add_argument("--config", default=PROJECT_CONFIG)
+    args = parser.parse_args(argv)
+
+    if args.first is None:
+        generate_and_send_daily_report(config_path=args.config, target_date=None)
+        return
+    first = datetime.strptime(args.first, "%Y-%m-%d").date()
+    last = datetime.strptime(args.last, "%Y-%m-%d").date() if args.last else first
+    backfill_reports(first, last, args.workers, args.config, force=args.force, summary_path=args.summary)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,344 @@
+# Compressed daily archives of the hourly measurement files
+#
+# Once a day is over, its hourly mesures_*.bin files are merged into one
+# mesures_<YYYY-mm-dd>.sma archive (mesures_chN_... for the other channels)
+# and the hourly .bin and .csv files are removed; the sub-second short_* and
+# spectrum_* files are archived the same way. Layout:
+#   MAGIC (8 bytes) | version (uint16) | JSON length (uint32) | JSON metadata
+#   then compressed blocks of BLOCK_RECORDS records.
+# The metadata is the one of the hourly files plus "codec" and "blocks", the
+# index: [first timestamp, last timestamp, records, offset, length, crc32]
+# per block, so a time range only decompresses the blocks it overlaps.
+# In a block, timestamps (as int64 bit patterns) and every int16 column are
+# delta-encoded, byte-shuffled and compressed with zlib or lzma; decoding
+# gives back the exact records.
+#
+# Command line:
+#   python archive.py compact [--dir DIR] [--codec zlib|lzma] [--keep-hourly]
+#   python archive.py retain [--dir DIR] [--keep-days N] [--max-gb X]
+#   python archive.py info FILE [FILE ...]
+
+import os
+import re
+import sys
+import json
+import mmap
+import lzma
+import zlib
+import argparse
+from datetime import datetime, date, timedelta
+import numpy as np
+import measure_format
+
+MAGIC = b"SNDMARCH"
+ARCHIVE_VERSION = 1
+ARCHIVE_EXT = ".sma"
+BLOCK_RECORDS = 900     # 15 minutes of 1 s records
+DEFAULT_DIR = "/home/acoustic/Documents/Mesures/measurements"
+CLOSE_MARGIN = 3600     # a day is compacted one hour after its end
+
+HOURLY_PATTERN = re.compile(r"^((?:mesures|short|spectrum)(?:_ch\d+)?)_(\d{4}-\d{2}-\d{2})_(\d{2})(?:_v2(?:_\d+)?)?\.(bin|csv)$")
+ARCHIVE_PATTERN = re.compile(r"^((?:mesures|short|spectrum)(?:_ch\d+)?)_(\d{4}-\d{2}-\d{2})\.sma$")
+
+CODECS = {
+    "zlib": (lambda data: zlib.compress(data, 9), zlib.decompress),
+    "lzma": (lambda data: lzma.compress(data, preset=6), lzma.decompress),
+}
+
+def shuffle(array):
+    """Bytes of array grouped by byte position (all first bytes, then all second bytes...)."""
+    return np.ascontiguousarray(array).view(np.uint8).reshape(-1, array.dtype.itemsize).T.tobytes()
+
+def unshuffle(data, dtype, count):
+    dtype = np.dtype(dtype)
+    raw = np.frombuffer(data, dtype=np.uint8, count=count * dtype.itemsize)
+    return raw.reshape(dtype.itemsize, count).T.copy().view(dtype).ravel()
+
+def encode_block(timestamps, values, codec):
+    """Delta-encode and compress one block; wrap-around int arithmetic keeps it exact."""
+    bits = np.ascontiguousarray(timestamps, dtype="<f8").view("<i8")
+    ts_delta = np.diff(bits, prepend=np.int64(0))
+    values = np.ascontiguousarray(values, dtype="<i2")
+    v_delta = np.diff(values, axis=0, prepend=np.zeros((1, values.shape[1]), dtype="<i2"))
+    # Column by column so that each column's small deltas sit together
+    payload = shuffle(ts_delta) + shuffle(np.ascontiguousarray(v_delta.T).ravel())
+    return CODECS[codec][0](payload)
+
+def decode_block(data, count, n_values, codec):
+    payload = CODECS[codec][1](data)
+    ts_delta = unshuffle(payload[:8 * count], "<i8", count)
+    v_delta = unshuffle(payload[8 * count:], "<i2", count * n_values).reshape(n_values, count).T
+    timestamps = np.cumsum(ts_delta, dtype=np.int64).view("<f8")
+    values = np.cumsum(v_delta, axis=0, dtype=np.int16)
+    return timestamps, values
+
+def write_archive(path, metadata, timestamps, values, codec="zlib", block_records=BLOCK_RECORDS):
+    """Write (atomically) an archive of records sorted by time."""
+    blocks, chunks, offset = [], [], 0
+    for start in range(0, len(timestamps), block_records):
+        ts = timestamps[start:start + block_records]
+        data = encode_block(ts, values[start:start + block_records], codec)
+        blocks.append([float(ts[0]), float(ts[-1]), len(ts), offset, len(data), zlib.crc32(data)])
+        chunks.append(data)
+        offset += len(data)
+    meta = {k: v for k, v in metadata.items() if k not in ("version", "checksum", "blocks", "codec")}
+    meta.update(codec=codec, blocks=blocks)
+    payload = json.dumps(meta).encode("utf-8")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(measure_format.PREAMBLE.pack(MAGIC, ARCHIVE_VERSION, len(payload)) + payload)
+        for data in chunks:
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+def read_archive_header(f):
+    f.seek(0)
+    preamble = f.read(measure_format.PREAMBLE.size)
+    if len(preamble) < measure_format.PREAMBLE.size or preamble[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a measurement archive")
+    _, version, length = measure_format.PREAMBLE.unpack(preamble)
+    if version > ARCHIVE_VERSION:
+        raise ValueError(f"Unsupported archive version {version}")
+    payload = f.read(length)
+    if len(payload) < length:
+        raise ValueError("Truncated archive header")
+    return json.loads(payload.decode("utf-8")), measure_format.PREAMBLE.size + length
+
+class ArchiveFile:
+    """
+    Read side of an archive, with the same interface as
+    measure_reader.MeasurementFile. select() decompresses only the blocks
+    overlapping the requested range; the last decoded blocks are kept.
+    """
+
+    def __init__(self, path, cache_blocks=8):
+        self.path = path
+        self.size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            self.metadata, self.header_size = read_archive_header(f)
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.columns = list(self.metadata["columns"])
+        self.scale = float(self.metadata.get("scale", measure_format.SCALE))
+        self.dtype = measure_format.record_dtype(len(self.columns), checksum=False)
+        self.codec = self.metadata["codec"]
+        blocks = np.array(self.metadata["blocks"], dtype=np.float64).reshape(-1, 6)
+        self.firsts, self.lasts = blocks[:, 0], blocks[:, 1]
+        self.blocks = self.metadata["blocks"]
+        self.cache_blocks = cache_blocks
+        self.cache = {}
+
+    def __len__(self):
+        return int(sum(b[2] for b in self.blocks))
+
+    def block(self, i):
+        records = self.cache.get(i)
+        if records is None:
+            _, _, count, offset, length, crc = self.blocks[i]
+            start = self.header_size + offset
+            data = self.map[start:start + length]
+            records = np.zeros(0, dtype=self.dtype)
+            if zlib.crc32(data) != crc:
+                print(f"{self.path} : block {i} is corrupted, skipped")
+            else:
+                records = np.zeros(count, dtype=self.dtype)
+                records["timestamp"], records["values"] = decode_block(data, count, len(self.columns), self.codec)
+            if len(self.cache) >= self.cache_blocks:
+                self.cache.pop(next(iter(self.cache)))
+            self.cache[i] = records
+        return records
+
+    @property
+    def records(self):
+        parts = [self.block(i) for i in range(len(self.blocks))]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=self.dtype)
+
+    @property
+    def timestamps(self):
+        return self.records["timestamp"]
+
+    def time_span(self):
+        if not len(self.blocks):
+            return None, None
+        return float(self.firsts[0]), float(self.lasts[-1])
+
+    def select(self, start=None, end=None, validate=False):
+        """Records with start <= timestamp < end (blocks carry their own crc, validate is not needed)."""
+        lo = 0 if start is None else int(np.searchsorted(self.lasts, start, side="left"))
+        hi = len(self.blocks) if end is None else int(np.searchsorted(self.firsts, end, side="left"))
+        parts = [self.block(i) for i in range(lo, hi)]
+        if not parts:
+            return np.zeros(0, dtype=self.dtype)
+        records = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        ts = records["timestamp"]
+        a = 0 if start is None else int(np.searchsorted(ts, start, side="left"))
+        b = len(ts) if end is None else int(np.searchsorted(ts, end, side="left"))
+        return records[a:b]
+
+# ----------------------------
+# Compaction
+
+def hourly_files(meas_dir):
+    """{(prefix, day): [file names]} of the hourly .bin and .csv files."""
+    groups = {}
+    for name in os.listdir(meas_dir):
+        match = HOURLY_PATTERN.match(name)
+        if match:
+            day = datetime.strptime(match.group(2), "%Y-%m-%d").date()
+            groups.setdefault((match.group(1), day), []).append(name)
+    return groups
+
+def archive_path(meas_dir, prefix, day):
+    return os.path.join(meas_dir, f"{prefix}_{day.isoformat()}{ARCHIVE_EXT}")
+
+def compact_day(meas_dir, prefix, day, names, codec="zlib", remove=True):
+    """
+    Merge the hourly .bin files of one day into its archive (merged with an
+    existing archive of that day), check the archive and remove the hourly
+    files it replaces. Files with other columns are left in place. Records
+    already in the archive are not added again, so compacting with
+    remove=False can be repeated.
+    """
+    bins = sorted(n for n in names if n.endswith(".bin"))
+    if not bins:
+        return None
+    metadata, ts_parts, value_parts, done = None, [], [], []
+    path = archive_path(meas_dir, prefix, day)
+    if os.path.exists(path):
+        existing = ArchiveFile(path)
+        metadata = existing.metadata
+        records = existing.records
+        ts_parts.append(records["timestamp"])
+        value_parts.append(records["values"])
+    for name in bins:
+        try:
+            meta, records = measure_format.read_records(os.path.join(meas_dir, name))
+        except (OSError, ValueError) as e:
+            print(f"Skipping {name} : {e}")
+            continue
+        if metadata is None:
+            metadata = meta
+        elif list(meta["columns"]) != list(metadata["columns"]):
+            print(f"Skipping {name} : columns differ from the rest of the day")
+            continue
+        ts_parts.append(records["timestamp"])
+        value_parts.append(records["values"])
+        done.append(name)
+    if not done:
+        return None
+
+    timestamps = np.concatenate(ts_parts)
+    values = np.concatenate(value_parts)
+    order = np.argsort(timestamps, kind="stable")
+    timestamps, values = timestamps[order], values[order]
+    # First copy of each timestamp, the archive's one when it has it
+    unique = np.concatenate(([True], np.diff(timestamps) != 0))
+    timestamps, values = timestamps[unique], values[unique]
+    write_archive(path, metadata, timestamps, values, codec)
+
+    # Read back before anything is deleted
+    check = ArchiveFile(path).records
+    if not (np.array_equal(check["timestamp"], timestamps) and np.array_equal(check["values"], values)):
+        raise RuntimeError(f"{path} does not read back identical, hourly files kept")
+    if remove:
+        hours = {HOURLY_PATTERN.match(n).group(3) for n in done}
+        for name in names:
+            match = HOURLY_PATTERN.match(name)
+            # CSVs go with their hour's .bin; CSV-only (legacy) hours are kept
+            if name in done or (match.group(4) == "csv" and match.group(3) in hours):
+                os.remove(os.path.join(meas_dir, name))
+    return path
+
+def compact(meas_dir=DEFAULT_DIR, codec="zlib", before=None, remove=True, now=None):
+    """Compact every closed day (before the given date if any); returns the archives written."""
+    now = datetime.now().timestamp() if now is None else now
+    written = []
+    for (prefix, day), names in sorted(hourly_files(meas_dir).items()):
+        day_end = datetime(day.year, day.month, day.day) + timedelta(days=1)
+        if day_end.timestamp() + CLOSE_MARGIN > now or (before is not None and day >= before):
+            continue
+        try:
+            path = compact_day(meas_dir, prefix, day, names, codec, remove)
+        except Exception as e:
+            print(f"{prefix} {day.isoformat()} : compaction failed : {e}")
+            continue
+        if path:
+            print(f"{os.path.basename(path)} : {len(names)} hourly files compacted")
+            written.append(path)
+    return written
+
+def data_days(meas_dir):
+    """{day: [file names]} of all measurement data (hourly files and archives)."""
+    days = {}
+    for name in os.listdir(meas_dir):
+        match = HOURLY_PATTERN.match(name) or ARCHIVE_PATTERN.match(name)
+        if match:
+            day = datetime.strptime(match.group(2), "%Y-%m-%d").date()
+            days.setdefault(day, []).append(name)
+    return days
+
+def apply_retention(meas_dir=DEFAULT_DIR, keep_days=None, max_bytes=None, codec="zlib", today=None):
+    """
+    Compact the closed days, delete the days older than keep_days, then
+    delete the oldest days until the measurement data fit in max_bytes. The
+    current day is never deleted; rollup sidecars are kept.
+    """
+    today = date.today() if today is None else today
+    compact(meas_dir, codec)
+    days = data_days(meas_dir)
+    removed = []
+    if keep_days is not None:
+        for day in sorted(days):
+            if day < today - timedelta(days=keep_days):
+                removed.append(day)
+    if max_bytes is not None:
+        sizes = {day: sum(os.path.getsize(os.path.join(meas_dir, n)) for n in names) for day, names in days.items()}
+        total = sum(sizes[d] for d in days if d not in removed)
+        for day in sorted(days):
+            if total <= max_bytes or day >= today:
+                break
+            if day not in removed:
+                removed.append(day)
+                total -= sizes[day]
+    for day in removed:
+        for name in days[day]:
+            os.remove(os.path.join(meas_dir, name))
+        print(f"{day.isoformat()} : {len(days[day])} files deleted")
+    return removed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compaction and retention of the measurement files")
+    sub = parser.add_subparsers(dest="action", required=True)
+    p = sub.add_parser("compact", help="merge the closed days into compressed daily archives")
+    p.add_argument("--dir", default=DEFAULT_DIR)
+    p.add_argument("--codec", choices=sorted(CODECS), default="zlib")
+    p.add_argument("--keep-hourly", action="store_true", help="do not delete the hourly files")
+    p = sub.add_parser("retain", help="compact, then delete data by age and disk quota")
+    p.add_argument("--dir", default=DEFAULT_DIR)
+    p.add_argument("--codec", choices=sorted(CODECS), default="zlib")
+    p.add_argument("--keep-days", type=int, default=None)
+    p.add_argument("--max-gb", type=float, default=None)
+    p = sub.add_parser("info", help="summary of archives")
+    p.add_argument("files", nargs="+")
+    args = parser.parse_args(argv)
+
+    if args.action == "compact":
+        compact(args.dir, args.codec, remove=not args.keep_hourly)
+    elif args.action == "retain":
+        max_bytes = None if args.max_gb is None else int(args.max_gb * 1e9)
+        apply_retention(args.dir, args.keep_days, max_bytes, args.codec)
+    else:
+        for path in args.files:
+            try:
+                af = ArchiveFile(path)
+                first, last = af.time_span()
+                print(f"{path}: {len(af)} records | {len(af.blocks)} blocks | {af.codec} | "
+                      f"{datetime.fromtimestamp(first)} - {datetime.fromtimestamp(last)}")
+            except Exception as e:
+                print(f"{path}: error : {e}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
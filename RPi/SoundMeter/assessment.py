@@ -0,0 +1,189 @@
+# Assessment periods (day / evening / night) and the levels derived from them
+#
+# The "periods" of PROJECT_CONFIG.json are compiled into a table giving the
+# period of every minute of the day, one row per day type (Monday to Sunday,
+# then holidays), so a whole time array is classified with one lookup:
+#
+#   "periods": [{"name": "day", "start": 7, "end": 19, "limit": 55.0}, ...],
+#   "weekday_periods": {"sunday": [...], "saturday": [...]},   optional
+#   "holidays": ["2025-12-25", "2026-01-01"],                   optional
+#   "holiday_periods": [...]                                    optional, default: Sunday's
+#
+# Like classify_period in Report_And_Mail, the first period matching a time
+# wins, periods with end <= start run over midnight and unmatched minutes
+# fall back to the first period of the list.
+#
+# Lden and Ldn use their own fixed splits (LDEN_PERIODS, LDN_PERIODS) with
+# the evening / night penalties; they can be changed with "lden" / "ldn" in
+# the config, as lists of {"name", "start", "end", "penalty"}. Over several
+# days each period is energy-averaged over the whole range first.
+
+from datetime import datetime
+from functools import cached_property
+import numpy as np
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+HOLIDAY = 7
+MINUTES_PER_DAY = 24 * 60
+
+LDEN_PERIODS = [
+    {"name": "day", "start": 7, "end": 19, "penalty": 0.0},
+    {"name": "evening", "start": 19, "end": 23, "penalty": 5.0},
+    {"name": "night", "start": 23, "end": 7, "penalty": 10.0},
+]
+LDN_PERIODS = [
+    {"name": "day", "start": 7, "end": 22, "penalty": 0.0},
+    {"name": "night", "start": 22, "end": 7, "penalty": 10.0},
+]
+
+def minute_mask(start, end):
+    """Minutes of the day in [start, end) hours, over midnight when end <= start."""
+    minutes = np.arange(MINUTES_PER_DAY)
+    s, e = round(start * 60), round(end * 60)
+    if s < e:
+        return (minutes >= s) & (minutes < e)
+    return (minutes >= s) | (minutes < e)
+
+class PeriodSchedule:
+    """
+    Compiled period table. Each distinct (name, limit) pair gets an entry id;
+    classify() returns entry ids, names[entry_name[id]] is its period name.
+    """
+
+    def __init__(self, periods, weekday_periods=None, holidays=(), holiday_periods=None):
+        if not periods:
+            raise ValueError("At least one period is needed")
+        weekday_periods = {str(k).lower(): v for k, v in (weekday_periods or {}).items()}
+        day_lists = [weekday_periods.get(day, periods) for day in WEEKDAYS]
+        day_lists.append(holiday_periods or weekday_periods.get("sunday", periods))
+
+        self.entries = []
+        self.names = []
+        index = {}
+        self.table = np.zeros((len(day_lists), MINUTES_PER_DAY), dtype=np.int32)
+        for row, plist in enumerate(day_lists):
+            ids = []
+            for p in plist:
+                key = (p["name"], p.get("limit"))
+                if key not in index:
+                    index[key] = len(self.entries)
+                    self.entries.append(dict(p))
+                    if p["name"] not in self.names:
+                        self.names.append(p["name"])
+                ids.append(index[key])
+            # Reversed so that the first matching period wins
+            self.table[row] = ids[0]
+            for p, i in reversed(list(zip(plist, ids))):
+                self.table[row][minute_mask(p["start"], p["end"])] = i
+        self.limits = np.array([float(e.get("limit", np.nan)) for e in self.entries])
+        self.penalties = np.array([float(e.get("penalty", 0.0)) for e in self.entries])
+        self.entry_name = np.array([self.names.index(e["name"]) for e in self.entries])
+        self.holiday_list = list(holidays)
+        self.holiday_dates = {datetime.strptime(str(h)[:10], "%Y-%m-%d").date() for h in self.holiday_list}
+        self.lden_periods = LDEN_PERIODS
+        self.ldn_periods = LDN_PERIODS
+
+    @classmethod
+    def from_config(cls, cfg):
+        schedule = cls(cfg.get("periods", []), cfg.get("weekday_periods"),
+                       cfg.get("holidays", []), cfg.get("holiday_periods"))
+        schedule.lden_periods = cfg.get("lden", LDEN_PERIODS)
+        schedule.ldn_periods = cfg.get("ldn", LDN_PERIODS)
+        return schedule
+
+    @cached_property
+    def holidays(self):
+        import pandas as pd
+        return pd.DatetimeIndex(pd.to_datetime(self.holiday_list)).normalize()
+
+    def day_types(self, days):
+        """Row of the table for each (normalized) day: weekday, or HOLIDAY."""
+        types = np.asarray(days.dayofweek, dtype=np.int64)
+        if len(self.holidays):
+            types[days.isin(self.holidays)] = HOLIDAY
+        return types
+
+    def classify(self, times):
+        """Entry id of each time (pandas.DatetimeIndex), any number of days."""
+        import pandas as pd
+        times = pd.DatetimeIndex(times)
+        if not len(times):
+            return np.zeros(0, dtype=np.int32)
+        # Day types only once per distinct day
+        codes, days = pd.factorize(times.normalize())
+        types = self.day_types(pd.DatetimeIndex(days))[codes]
+        minutes = np.asarray(times.hour * 60 + times.minute)
+        return self.table[types, minutes]
+
+    def limit_series(self, times):
+        return self.limits[self.classify(times)]
+
+    def limit_at(self, timestamp):
+        """Limit at one epoch time, without pandas (used every second by measure.py)."""
+        moment = datetime.fromtimestamp(timestamp)
+        day_type = HOLIDAY if moment.date() in self.holiday_dates else moment.weekday()
+        return float(self.limits[self.table[day_type, moment.hour * 60 + moment.minute]])
+
+    def period_of(self, times):
+        """Period name id (index in names) of each time."""
+        return self.entry_name[self.classify(times)]
+
+    def hours(self, day_type=0):
+        """Duration in hours of each period name on one day type."""
+        return np.bincount(self.entry_name[self.table[day_type]], minlength=len(self.names)) / 60.0
+
+def energy_means(levels, groups, n_groups):
+    """Energy-average level and number of valid values of each group (NaN levels ignored)."""
+    levels = np.asarray(levels, dtype=np.float64)
+    valid = ~np.isnan(levels)
+    groups = np.asarray(groups)[valid]
+    counts = np.bincount(groups, minlength=n_groups)
+    energy = np.bincount(groups, weights=10.0 ** (levels[valid] / 10.0), minlength=n_groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = 10.0 * np.log10(energy / counts)
+    return means, counts
+
+def period_levels(times, laeq_1s, schedule):
+    """
+    Per period name: LAeq, number of valid seconds, seconds above the limit
+    in force and their share of the period.
+    """
+    entry = schedule.classify(times)
+    group = schedule.entry_name[entry]
+    n = len(schedule.names)
+    laeq_1s = np.asarray(laeq_1s, dtype=np.float64)
+    means, counts = energy_means(laeq_1s, group, n)
+    exceed = np.bincount(group[laeq_1s > schedule.limits[entry]], minlength=n)
+    out = {}
+    for i, name in enumerate(schedule.names):
+        out[name] = dict(
+            laeq=float(means[i]), n=int(counts[i]), n_exceed=int(exceed[i]),
+            pct_time=float(100.0 * exceed[i] / counts[i]) if counts[i] else 0.0,
+        )
+    return out
+
+def penalized_level(times, laeq_1s, periods):
+    """
+    Day-evening-night style level: the energy average of each period over the
+    whole range, weighted by the period duration with its penalty added.
+    Returns (level, {name: period LAeq}).
+    """
+    schedule = PeriodSchedule(periods)
+    group = schedule.entry_name[schedule.classify(times)]
+    means, counts = energy_means(laeq_1s, group, len(schedule.names))
+    hours = schedule.hours()
+    penalties = np.array([schedule.penalties[schedule.entry_name == i][0] for i in range(len(schedule.names))])
+    per_period = {name: float(m) for name, m in zip(schedule.names, means)}
+    if (counts == 0).any():
+        return np.nan, per_period
+    level = 10.0 * np.log10(np.sum(hours / 24.0 * 10.0 ** ((means + penalties) / 10.0)))
+    return float(level), per_period
+
+def lden_levels(times, laeq_1s, schedule=None):
+    """Lden, Ldn, Lday, Levening and Lnight over the given range (NaN if a period has no data)."""
+    lden, den = penalized_level(times, laeq_1s, schedule.lden_periods if schedule else LDEN_PERIODS)
+    ldn, _ = penalized_level(times, laeq_1s, schedule.ldn_periods if schedule else LDN_PERIODS)
+    return {
+        "Lden": lden, "Ldn": ldn,
+        "Lday": den.get("day", np.nan), "Levening": den.get("evening", np.nan), "Lnight": den.get("night", np.nan),
+    }
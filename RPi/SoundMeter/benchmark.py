@@ -0,0 +1,221 @@
+# Real-time budget benchmark of the measure.py DSP stages
+#
+#   python benchmark.py [--blocks 30] [--output bench.json] [--compare old.json] [--budget-scale 1.0]
+#
+# Synthetic one-second blocks (1 kHz tone, pink noise, impulses) go through
+# each stage; no audio device is needed. For every stage the latency
+# percentiles, the real-time factor (seconds of audio processed per second
+# of CPU), the memory allocated per block (tracemalloc, in a separate pass)
+# and the budget check are printed and saved as JSON, so that runs of two
+# commits can be compared with --compare.
+#
+# The budgets are in ms per one-second block on a Pi 4; --budget-scale
+# scales them for another machine (e.g. 0.3 on a desktop CPU).
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+import numpy as np
+import scipy
+import measure
+import narrowband
+
+SAMPLERATE = measure.SAMPLERATE
+FACTOR = 0.5
+
+# ms per one-second block on a Pi 4
+BUDGETS_MS = {
+    "filter_pond": 60,
+    "signal_to_db_pond": 250,
+    "compute_LAeq_1s": 60,
+    "band_analysis": 400,
+    "streaming_weighting": 120,
+    "filter_bank": 350,
+    "process_block": 500,
+    "process_block_sub_second": 550,
+    "narrowband": 60,
+    "persistence": 20,
+    "persistence_sub_second": 20,
+}
+REGRESSION = 1.2    # --compare fails when a stage gets 20 % slower
+
+def pink_noise(n, rng):
+    """1/f noise by spectral shaping of white noise."""
+    spectrum = np.fft.rfft(rng.standard_normal(n))
+    f = np.arange(len(spectrum))
+    f[0] = 1
+    return np.fft.irfft(spectrum / np.sqrt(f), n)
+
+def test_blocks(n_blocks, sample_rate=SAMPLERATE, seed=0):
+    """One-second blocks cycling through a tone, pink noise and impulses, around 70-90 dB."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(sample_rate) / sample_rate
+    tone = 0.1 * np.sin(2 * np.pi * 1000 * t)
+    pink = pink_noise(sample_rate * n_blocks, rng)
+    pink = 0.05 * pink / np.std(pink)
+    impulses = np.zeros(sample_rate)
+    impulses[::sample_rate // 8] = 0.8
+    blocks = []
+    for i in range(n_blocks):
+        kind = i % 3
+        if kind == 0:
+            block = tone
+        elif kind == 1:
+            block = pink[i * sample_rate:(i + 1) * sample_rate]
+        else:
+            block = impulses + 0.001 * rng.standard_normal(sample_rate)
+        blocks.append(block.astype(np.float32))
+    return blocks
+
+def make_stages(tmp_dir, sample_rate=SAMPLERATE):
+    """{name: function(block, i)} of the stages, with their state created once as in measure.py."""
+    pipeline = measure.MeasurementPipeline(FACTOR, save=False, ring=measure.RingBuffer(1),
+                                           sample_rate=sample_rate, verbose=False)
+    weighting = measure.StreamingWeighting(sample_rate)
+    bank = measure.ThirdOctaveFilterBank(sample_rate)
+    tau = measure.TIME_CONSTANTS["Fast"]
+    # 100 ms broadband and 500 ms band records
+    sub_second = measure.MeasurementPipeline(FACTOR, save=False, ring=measure.RingBuffer(1),
+                                             sample_rate=sample_rate, verbose=False,
+                                             short_interval=0.1, band_interval=0.5)
+    writer = measure.HourlyWriter(tmp_dir, pipeline.file_metadata(0))
+    line = [60.0] * len(pipeline.file_metadata(0)["columns"])
+    short_writer = measure.HourlyWriter(tmp_dir, sub_second.interval_metadata(
+        0, measure.SHORT_COLUMNS, 0.1, measure.SHORT_WEIGHTING), "short", csv=False)
+    short_values = np.full((10, len(measure.SHORT_COLUMNS)), 60.0)
+    # 10 s intervals so that the interval close (tone search) shows in the percentiles
+    analyzer = narrowband.NarrowbandAnalyzer(sample_rate, 1, FACTOR, interval=10)
+    t0 = time.time()
+
+    return {
+        "filter_pond": lambda block, i: measure.filter_pond(block, "A", sample_rate),
+        "signal_to_db_pond": lambda block, i: measure.signal_to_db_pond(block, FACTOR, tau, "A"),
+        "compute_LAeq_1s": lambda block, i: measure.compute_LAeq_1s(block, FACTOR, sample_rate),
+        "band_analysis": lambda block, i: measure.band_analysis(block, sample_rate, FACTOR),
+        "streaming_weighting": lambda block, i: (weighting.process(block[None, :]), weighting.levels(FACTOR)),
+        "filter_bank": lambda block, i: bank.process(block[None, :], FACTOR),
+        "process_block": lambda block, i: pipeline.process_block(block[:, None], t0 + i),
+        "process_block_sub_second": lambda block, i: sub_second.process_block(block[:, None], t0 + i),
+        "narrowband": lambda block, i: analyzer.add(block[None, :], t0 + i),
+        "persistence": lambda block, i: writer.write(t0 + i, line),
+        "persistence_sub_second": lambda block, i: short_writer.write_many(t0 + i + np.arange(-9, 1) / 10,
+                                                                           short_values),
+    }, [writer, short_writer]
+
+def run_stage(func, blocks, warmup=2):
+    for i, block in enumerate(blocks[:warmup]):
+        func(block, i)
+    times = []
+    for i, block in enumerate(blocks):
+        start = time.perf_counter()
+        func(block, i)
+        times.append(time.perf_counter() - start)
+    times = np.array(times) * 1000
+
+    # Allocations in a separate pass, tracemalloc slows everything down
+    tracemalloc.start()
+    peaks, counts = [], []
+    for i, block in enumerate(blocks[:5]):
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        base, _ = tracemalloc.get_traced_memory()
+        func(block, i)
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        peaks.append(peak - base)
+        counts.append(sum(max(0, s.count_diff) for s in after.compare_to(before, "lineno")))
+    tracemalloc.stop()
+
+    return {
+        "p50_ms": float(np.percentile(times, 50)),
+        "p90_ms": float(np.percentile(times, 90)),
+        "p99_ms": float(np.percentile(times, 99)),
+        "max_ms": float(times.max()),
+        "mean_ms": float(times.mean()),
+        "realtime_factor": float(1000.0 / times.mean()) if times.mean() > 0 else float("inf"),
+        "alloc_peak_bytes": int(np.median(peaks)),
+        "alloc_blocks_retained": int(np.median(counts)),
+    }
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+def run(n_blocks=30, stages=None, budget_scale=1.0):
+    blocks = test_blocks(n_blocks)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        funcs, writers = make_stages(tmp_dir)
+        results = {}
+        for name, func in funcs.items():
+            if stages and name not in stages:
+                continue
+            r = run_stage(func, blocks)
+            r["budget_ms"] = BUDGETS_MS[name] * budget_scale
+            r["within_budget"] = r["p99_ms"] <= r["budget_ms"]
+            results[name] = r
+        for writer in writers:
+            writer.close()
+    return {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "sample_rate": SAMPLERATE,
+        "blocks": n_blocks,
+        "budget_scale": budget_scale,
+        "stages": results,
+    }
+
+def compare(current, previous):
+    """Stages whose p50 got more than REGRESSION times slower than in previous."""
+    slower = []
+    for name, r in current["stages"].items():
+        old = previous.get("stages", {}).get(name)
+        if old and r["p50_ms"] > REGRESSION * old["p50_ms"]:
+            slower.append((name, old["p50_ms"], r["p50_ms"]))
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage real-time benchmark of the DSP")
+    parser.add_argument("--blocks", type=int, default=30)
+    parser.add_argument("--stage", action="append", help="only this stage (repeatable)")
+    parser.add_argument("--output", help="JSON file for the results")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    parser.add_argument("--budget-scale", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    result = run(args.blocks, args.stage, args.budget_scale)
+    print(f"{'stage':<26} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'x RT':>8} {'alloc MB':>9}  budget")
+    for name, r in result["stages"].items():
+        print(f"{name:<26} {r['p50_ms']:8.2f} {r['p90_ms']:8.2f} {r['p99_ms']:8.2f} "
+              f"{r['realtime_factor']:8.1f} {r['alloc_peak_bytes'] / 1e6:9.2f}  "
+              f"{'OK' if r['within_budget'] else 'OVER'} ({r['budget_ms']:.0f} ms)")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    failed = not all(r["within_budget"] for r in result["stages"].values())
+    if args.compare:
+        with open(args.compare, "r") as f:
+            previous = json.load(f)
+        for name, old, new in compare(result, previous):
+            print(f"{name} : {old:.2f} ms -> {new:.2f} ms (commit {previous.get('commit')})")
+            failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
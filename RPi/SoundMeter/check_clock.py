@@ -0,0 +1,81 @@
+# Sample clock timestamps under simulated clock drift
+#
+#   python check_clock.py            exit code 1 if a case fails
+#
+# Audio callbacks are simulated for hours with an ADC running fast or slow
+# against the system clock, with scheduling jitter and with the system clock
+# set forward or back. The records stamped by measure.SampleClock must
+# always increase, stay one second apart to measure.MAX_SLEW outside of the
+# forward steps, and end close to the system clock.
+
+import sys
+from types import SimpleNamespace
+import numpy as np
+import measure
+
+SAMPLE_RATE = 48000
+CHUNK = 4800            # 100 ms callbacks
+T0 = 1.7e9
+STEP_TOLERANCE = measure.MAX_SLEW + 1e-6      # rounding of the epoch times
+FINAL_TOLERANCE = 0.02
+
+# name: (ppm of the ADC, hours, {hour: system clock step in s}, ADC times available)
+# A clock set back is caught up at MAX_SLEW, about 35 min per second
+CASES = {
+    "+100 ppm, 8 h": (100, 8, {}, True),
+    "-100 ppm, 8 h": (-100, 8, {}, True),
+    "+100 ppm, no ADC times": (100, 2, {}, False),
+    "system clock set forward 30 s": (20, 2, {0.5: 30.0}, True),
+    "system clock set back 2 s": (-20, 2, {0.5: -2.0}, True),
+    "system clock set back 30 s": (20, 20, {0.5: -30.0}, True),
+}
+
+def simulate(ppm, hours, steps, adc_times, seed=0):
+    """(record timestamps, system time of the end of each record) of a simulated stream."""
+    rng = np.random.default_rng(seed)
+    period = 1.0 / (SAMPLE_RATE * (1 + ppm * 1e-6))
+    clock = measure.SampleClock(SAMPLE_RATE)
+    stamps, truth = [], []
+    next_record = SAMPLE_RATE
+    for k in range(int(hours * 3600 * SAMPLE_RATE / CHUNK)):
+        first = k * CHUNK
+        adc = first * period
+        now = adc + CHUNK * period + 0.005 + rng.uniform(0, 0.003)
+        offset = sum(step for hour, step in steps.items() if now >= hour * 3600)
+        if adc_times:
+            # Stream time base of the driver, unaffected by the system clock
+            time_info = SimpleNamespace(inputBufferAdcTime=10 + adc + rng.normal(0, 2e-4), currentTime=10 + now)
+        else:
+            time_info = SimpleNamespace(inputBufferAdcTime=0, currentTime=0)
+        clock.observe(first, CHUNK, time_info, T0 + now + offset)
+        while next_record <= first + CHUNK:
+            stamps.append(clock.stamp(next_record))
+            truth.append(T0 + next_record * period + offset)
+            next_record += SAMPLE_RATE
+    return np.array(stamps), np.array(truth), clock
+
+def main():
+    failed = False
+    for name, (ppm, hours, steps, adc_times) in CASES.items():
+        stamps, truth, clock = simulate(ppm, hours, steps, adc_times)
+        diff = np.diff(stamps)
+        problems = []
+        if (diff <= 0).any():
+            problems.append(f"{int((diff <= 0).sum())} timestamps not after the previous one")
+        forward = sum(1 for step in steps.values() if step > 0)
+        uneven = np.abs(diff - 1) > STEP_TOLERANCE
+        if uneven.sum() > forward:
+            problems.append(f"{int(uneven.sum())} steps away from 1 s (largest {np.abs(diff - 1).max():.4f} s)")
+        if clock.resyncs != forward:
+            problems.append(f"{clock.resyncs} resyncs instead of {forward}")
+        error = abs(stamps[-1] - truth[-1])
+        if error > FINAL_TOLERANCE:
+            problems.append(f"ends {error * 1000:.1f} ms off the system clock")
+        failed |= bool(problems)
+        rate = (1 / (clock.period * SAMPLE_RATE) - 1) * 1e6
+        print(f"{name}: measured {rate:+.1f} ppm, final offset {error * 1000:.1f} ms, "
+              f"steps {diff.min():.4f}-{diff.max():.4f} s {'; '.join(problems) if problems else 'OK'}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+# Import-time budget of the report and processing modules
+#
+#   python check_import_time.py            exit code 1 if a budget is exceeded
+#
+# Each module is imported in a fresh interpreter (python -X importtime, best
+# of a few runs) and must stay under its budget without pulling in the heavy
+# dependencies that are only needed on some code paths.
+
+import os
+import re
+import subprocess
+import sys
+
+# Module: (budget in ms, modules that must not be loaded by the import)
+# Numpy alone takes most of the budget; the margins are sized for a Pi 4.
+BUDGETS = {
+    "Report_And_Mail": (400, ["pandas", "matplotlib", "smtplib", "email.mime"]),
+    "assessment": (350, ["pandas"]),
+    "level_stats": (350, []),
+    "measure_format": (350, []),
+    "measure_reader": (350, []),
+    "narrowband": (350, []),
+    "rollups": (350, []),
+}
+RUNS = 3
+
+def import_time_ms(module):
+    """Cumulative import time of module in a fresh interpreter, in ms."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=here, capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+\s+\|\s+(\d+)\s+\|\s?(\S+)$", line)
+        if match and match.group(2) == module:
+            return int(match.group(1)) / 1000.0
+    raise RuntimeError(f"No import time reported for {module}")
+
+def loaded_modules(module, names):
+    """Which of names end up in sys.modules after importing module."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = (f"import sys, {module}; "
+            f"print(' '.join(n for n in {names!r} if any(m == n or m.startswith(n + '.') for m in sys.modules)))")
+    result = subprocess.run([sys.executable, "-c", code], cwd=here, capture_output=True, text=True)
+    return result.stdout.split()
+
+def main():
+    failed = False
+    for module, (budget, forbidden) in BUDGETS.items():
+        try:
+            ms = min(import_time_ms(module) for _ in range(RUNS))
+        except RuntimeError as e:
+            print(f"{module}: error : {e}")
+            failed = True
+            continue
+        heavy = loaded_modules(module, forbidden) if forbidden else []
+        ok = ms <= budget and not heavy
+        failed |= not ok
+        extra = f" | loads {', '.join(heavy)}" if heavy else ""
+        print(f"{module}: {ms:.0f} ms (budget {budget} ms){extra} {'OK' if ok else 'FAIL'}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+# Histogram percentiles against np.percentile on awkward inputs
+#
+#   python check_level_stats.py            exit code 1 if a case differs
+#
+# Digital silence gives LAeq = -inf and missing seconds are NaN; both appear
+# in the days the report loads. The histogram path must either give the
+# same levels as np.percentile or leave them to the float path.
+
+import sys
+import warnings
+import numpy as np
+import level_stats
+
+CASES = {
+    "on the grid": [30.0, 31.2, 45.7, 30.0, 52.1],
+    "off the grid": [30.04, 31.2, 45.7],
+    "NaN": [np.nan, 30.0, 31.2, np.nan, 45.7],
+    "-inf": [-np.inf, 30.0, 31.2],
+    "-inf and NaN": [-np.inf, np.nan, 30.0, 31.2, -np.inf, 45.7],
+    "+inf": [30.0, np.inf, 31.2],
+    "only NaN": [np.nan, np.nan],
+}
+PERCENTILES = (5, 10, 50, 90, 95)
+
+def expected(levels, p):
+    levels = np.asarray(levels, dtype=np.float64)
+    levels = levels[~np.isnan(levels)]
+    return float(np.percentile(levels, p)) if len(levels) else np.nan
+
+def same(a, b):
+    return (np.isnan(a) and np.isnan(b)) or a == b or abs(a - b) < 1e-9
+
+def main():
+    failed = False
+    # -inf - -inf in the interpolation warns in numpy as well
+    warnings.simplefilter("ignore", RuntimeWarning)
+    for name, levels in CASES.items():
+        problems = []
+        try:
+            for p in PERCENTILES:
+                got, want = level_stats.percentile(levels, p), expected(levels, p)
+                if not same(got, want):
+                    problems.append(f"percentile {p}: {got} instead of {want}")
+            ln = level_stats.ln_levels(levels)
+            for n in level_stats.LN_DEFAULT:
+                want = expected(levels, 100 - n)
+                if not same(ln[f"L{n}"], want):
+                    problems.append(f"L{n}: {ln[f'L{n}']} instead of {want}")
+        except Exception as e:
+            problems.append(f"{type(e).__name__}: {e}")
+        failed |= bool(problems)
+        print(f"{name}: {'; '.join(problems) if problems else 'OK'}")
+
+    # The rolling path has no float fallback: non-finite levels must be refused, not misbinned
+    try:
+        level_stats.rolling_percentile(np.arange(3.0), [-np.inf, 30.0, 31.2], 2, 10)
+        print("rolling with -inf: no error FAIL")
+        failed = True
+    except ValueError:
+        print("rolling with -inf: refused OK")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
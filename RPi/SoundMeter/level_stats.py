@@ -0,0 +1,222 @@
+# Percentile levels (Ln) from 0.1 dB histograms
+#
+# The levels are stored with 0.1 dB resolution (int16 x 10 in the .bin files,
+# one decimal in the CSVs), so a histogram with one bin per 0.1 dB holds all
+# the information needed for exact percentiles. Histograms add up, so the
+# statistics of a period or of several days are the sum of smaller ones
+# (see LevelHistogram and the rollup sidecars).
+#
+# Ln is the level exceeded n % of the time, i.e. the (100 - n)th percentile:
+# L90 = percentile 10, L10 = percentile 90.
+#
+# Results are the same as np.percentile (linear interpolation) and, for the
+# sliding window, as pandas rolling(f"{window}s", center=True).quantile().
+
+import numpy as np
+import rollups
+
+# Same bins as the rollup histograms, so that they can be merged
+SCALE = round(1 / rollups.HIST_STEP_DB)     # bins per dB
+LN_DEFAULT = (5, 10, 50, 90, 95)
+
+def quantize(levels):
+    """
+    Bin numbers (level * 10) of the levels, or None if some levels are not
+    finite (e.g. -inf for digital silence) or not on the 0.1 dB grid (the
+    callers then use the exact float path).
+    """
+    levels = np.asarray(levels, dtype=np.float64)
+    if not np.isfinite(levels).all():
+        return None
+    bins = np.rint(levels * SCALE)
+    if not np.array_equal(bins / SCALE, levels):
+        return None
+    return bins.astype(np.int64)
+
+def _lerp(a, b, t):
+    # Same expression as np.percentile with method="linear"
+    diff = b - a
+    return np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+
+class LevelHistogram:
+    """
+    Counts per 0.1 dB bin; counts[0] is bin "offset" (offset / 10 dB).
+    Histograms merge with + whatever their ranges.
+    """
+
+    def __init__(self, counts=None, offset=0):
+        self.counts = np.zeros(0, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        self.offset = int(offset)
+
+    @classmethod
+    def from_levels(cls, levels):
+        levels = np.asarray(levels, dtype=np.float64)
+        levels = levels[~np.isnan(levels)]
+        if not np.isfinite(levels).all():
+            raise ValueError("Infinite levels cannot be binned")
+        bins = quantize(levels)
+        if bins is None:
+            bins = np.rint(levels * SCALE).astype(np.int64)
+        if not len(bins):
+            return cls()
+        offset = int(bins.min())
+        return cls(np.bincount(bins - offset), offset)
+
+    @classmethod
+    def from_rollup(cls, hist):
+        """Histogram of a rollup row (rollups.HIST_STEP_DB bins starting at 0 dB)."""
+        return cls(hist, 0).trimmed()
+
+    def trimmed(self):
+        nz = np.flatnonzero(self.counts)
+        if not len(nz):
+            return LevelHistogram()
+        return LevelHistogram(self.counts[nz[0]:nz[-1] + 1], self.offset + nz[0])
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def __add__(self, other):
+        if not len(other.counts):
+            return LevelHistogram(self.counts.copy(), self.offset)
+        if not len(self.counts):
+            return LevelHistogram(other.counts.copy(), other.offset)
+        lo = min(self.offset, other.offset)
+        hi = max(self.offset + len(self.counts), other.offset + len(other.counts))
+        counts = np.zeros(hi - lo, dtype=np.int64)
+        counts[self.offset - lo:self.offset - lo + len(self.counts)] += self.counts
+        counts[other.offset - lo:other.offset - lo + len(other.counts)] += other.counts
+        return LevelHistogram(counts, lo)
+
+    def ranked(self, ranks):
+        """Levels of the given 0-based ranks in sorted order."""
+        cum = np.cumsum(self.counts)
+        return (np.searchsorted(cum, np.asarray(ranks), side="right") + self.offset) / SCALE
+
+    def percentile(self, p):
+        """Same as np.percentile(levels, p) on the levels counted here, NaN if empty."""
+        n = len(self)
+        p = np.asarray(p, dtype=np.float64)
+        if n == 0:
+            return np.full(p.shape, np.nan) if p.ndim else np.nan
+        virtual = (p / 100) * (n - 1)
+        lo = np.floor(virtual)
+        hi = np.minimum(lo + 1, n - 1)
+        result = _lerp(self.ranked(lo.astype(np.int64)), self.ranked(hi.astype(np.int64)), virtual - lo)
+        return result if p.ndim else float(result)
+
+    def ln(self, ns=LN_DEFAULT):
+        """{"L5": ..., "L90": ...}: level exceeded n % of the time."""
+        values = self.percentile([100 - n for n in ns])
+        return {f"L{n}": float(v) for n, v in zip(ns, values)}
+
+def percentile(levels, p):
+    """np.percentile of the finite levels, through the histogram when they are on the 0.1 dB grid."""
+    levels = np.asarray(levels, dtype=np.float64)
+    levels = levels[~np.isnan(levels)]
+    if quantize(levels) is None:
+        return float(np.percentile(levels, p)) if len(levels) else np.nan
+    return LevelHistogram.from_levels(levels).percentile(p)
+
+def ln_levels(levels, ns=LN_DEFAULT):
+    levels = np.asarray(levels, dtype=np.float64)
+    levels = levels[~np.isnan(levels)]
+    if quantize(levels) is None:
+        values = np.percentile(levels, [100 - n for n in ns]) if len(levels) else [np.nan] * len(ns)
+        return {f"L{n}": float(v) for n, v in zip(ns, values)}
+    return LevelHistogram.from_levels(levels).ln(ns)
+
+def window_bounds(seconds, window_sec, center=True):
+    """
+    [start, end) record indices of the time window of each record, as
+    pandas offset windows: (t - w/2, t + w/2] centered, (t - w, t] otherwise.
+    """
+    seconds = np.asarray(seconds, dtype=np.float64)
+    if center:
+        half = window_sec / 2
+        return (np.searchsorted(seconds, seconds - half, side="right"),
+                np.searchsorted(seconds, seconds + half, side="right"))
+    return np.searchsorted(seconds, seconds - window_sec, side="right"), np.arange(1, len(seconds) + 1)
+
+def rolling_percentile(seconds, levels, window_sec, p, center=True):
+    """
+    Percentile p of the levels in a sliding time window around each record
+    (seconds sorted, NaN levels ignored). The histogram is updated as records
+    enter and leave the window and the rank is tracked by a cursor, so each
+    step costs O(1) on slowly varying levels. Same values as
+    pd.Series(levels, index).rolling(f"{window_sec}s", center=center).quantile(p / 100).
+    """
+    levels = np.asarray(levels, dtype=np.float64)
+    n = len(levels)
+    out = np.full(n, np.nan)
+    valid = ~np.isnan(levels)
+    if not valid.any():
+        return out
+    bins = quantize(levels[valid])
+    if bins is None:
+        raise ValueError("Levels are not finite values on the 0.1 dB grid")
+    offset = int(bins.min())
+    rel = np.full(n, -1, dtype=np.int64)
+    rel[valid] = bins - offset
+    starts, ends = window_bounds(seconds, window_sec, center)
+    q = p / 100
+
+    counts = [0] * (int(rel.max()) + 1)
+    rel = rel.tolist()
+    lo_i = hi_i = 0
+    nobs = 0
+    k = 0          # cursor bin
+    below = 0      # records in the bins under k
+    low_vals = np.full(n, np.nan)
+    high_vals = np.full(n, np.nan)
+    fracs = np.zeros(n)
+    for i, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        while hi_i < end:
+            b = rel[hi_i]
+            if b >= 0:
+                counts[b] += 1
+                nobs += 1
+                if b < k:
+                    below += 1
+            hi_i += 1
+        while lo_i < start:
+            b = rel[lo_i]
+            if b >= 0:
+                counts[b] -= 1
+                nobs -= 1
+                if b < k:
+                    below -= 1
+            lo_i += 1
+        if nobs == 0:
+            continue
+        virtual = q * (nobs - 1)
+        r = int(virtual)
+        # Move the cursor to the bin holding rank r
+        while below > r:
+            k -= 1
+            below -= counts[k]
+        while below + counts[k] <= r:
+            below += counts[k]
+            k += 1
+        low_vals[i] = k
+        if virtual == r:
+            high_vals[i] = k
+            continue
+        if r + 1 < below + counts[k]:
+            high_vals[i] = k
+        else:
+            j = k + 1
+            while not counts[j]:
+                j += 1
+            high_vals[i] = j
+        fracs[i] = virtual - r
+
+    done = ~np.isnan(low_vals)
+    low = (low_vals[done] + offset) / SCALE
+    high = (high_vals[done] + offset) / SCALE
+    # pandas rolling quantile interpolates as low + (high - low) * fraction
+    out[done] = low + (high - low) * fracs[done]
+    return out
+
+def rolling_ln(seconds, levels, window_sec, ns=LN_DEFAULT, center=True):
+    return {f"L{n}": rolling_percentile(seconds, levels, window_sec, 100 - n, center) for n in ns}
@@ -0,0 +1,146 @@
+# Latest measurement frame shared between measure.py and the web server
+#
+# measure.py publishes every new record (LAeq, bands, SPL_A/C/Z) into a small
+# memory-mapped file in /dev/shm; LaunchServer reads it without touching the
+# measurement directory. Layout:
+#   0   magic (8s) | 8 seq (uint64) | 16 n_values (uint32) | 20 columns length (uint32)
+#   24  timestamp (float64) | 32 crc32 of timestamp + values (uint32) | 36 padding
+#   40  values (float64 x n_values) | columns as JSON
+# The writer sets seq to an odd number while it updates the frame and to the
+# next even number when done (seqlock); a reader retries when seq changed or
+# was odd during its copy, and the crc catches anything that slipped through.
+
+import os
+import json
+import mmap
+import struct
+import tempfile
+import threading
+import time
+import zlib
+import numpy as np
+
+MAGIC = b"SMLIVE01"
+HEADER = struct.Struct("<8sQII")
+FRAME = struct.Struct("<dI4x")
+VALUES_OFFSET = HEADER.size + FRAME.size
+
+def shm_path(name):
+    """Path of a small file shared between measure.py and the web server (RAM-backed when possible)."""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, name)
+
+def default_path():
+    return shm_path("soundmeter_live.bin")
+
+class LiveFramePublisher:
+    """Writer side, used by a single thread of measure.py."""
+
+    def __init__(self, columns, path=None):
+        self.path = path or default_path()
+        self.columns = list(columns)
+        self.n_values = len(self.columns)
+        names = json.dumps(self.columns).encode("utf-8")
+        size = VALUES_OFFSET + 8 * self.n_values + len(names)
+        # A new file each run, so readers holding an older mapping see it go stale
+        tmp_path = f"{self.path}.{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(b"\0" * size)
+        os.replace(tmp_path, self.path)
+        self.file = open(self.path, "r+b")
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.map[VALUES_OFFSET + 8 * self.n_values:] = names
+        self.seq = 0
+        HEADER.pack_into(self.map, 0, MAGIC, self.seq, self.n_values, len(names))
+
+    def publish(self, timestamp, values):
+        values = np.asarray(values, dtype=np.float64)
+        payload = values.tobytes()
+        crc = zlib.crc32(struct.pack("<d", timestamp) + payload)
+        struct.pack_into("<Q", self.map, 8, self.seq + 1)
+        FRAME.pack_into(self.map, HEADER.size, timestamp, crc)
+        self.map[VALUES_OFFSET:VALUES_OFFSET + len(payload)] = payload
+        self.seq += 2
+        struct.pack_into("<Q", self.map, 8, self.seq)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+class LiveFrameReader:
+    """
+    Reader side. read() works on the mapping only; the file is (re)opened
+    only when there is no mapping yet or the frame has gone stale, which is
+    what happens when measure.py restarts and creates a new segment.
+    """
+
+    def __init__(self, path=None, stale_after=5.0, retries=20, reopen_every=1.0):
+        self.path = path or default_path()
+        self.stale_after = stale_after
+        self.retries = retries
+        self.reopen_every = reopen_every
+        self.last_open = 0.0
+        self.map = None
+        self.columns = None
+        self.lock = threading.Lock()
+
+    def _open(self):
+        self.close()
+        self.last_open = time.monotonic()
+        try:
+            with open(self.path, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.map = None
+            return False
+        magic, _, n_values, names_len = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.close()
+            return False
+        start = VALUES_OFFSET + 8 * n_values
+        self.n_values = n_values
+        self.columns = json.loads(bytes(self.map[start:start + names_len]).decode("utf-8"))
+        return True
+
+    def _read_frame(self):
+        for _ in range(self.retries):
+            seq1 = struct.unpack_from("<Q", self.map, 8)[0]
+            if seq1 % 2:
+                time.sleep(0.0005)
+                continue
+            timestamp, crc = FRAME.unpack_from(self.map, HEADER.size)
+            payload = bytes(self.map[VALUES_OFFSET:VALUES_OFFSET + 8 * self.n_values])
+            seq2 = struct.unpack_from("<Q", self.map, 8)[0]
+            if seq1 != seq2:
+                continue
+            if seq1 == 0:
+                return None
+            if zlib.crc32(struct.pack("<d", timestamp) + payload) != crc:
+                continue
+            return {
+                "seq": seq1 // 2,
+                "timestamp": timestamp,
+                "values": dict(zip(self.columns, np.frombuffer(payload, dtype=np.float64).tolist())),
+            }
+        return None
+
+    def read(self):
+        """Latest frame as {"seq", "timestamp", "values": {column: level}}, None if there is none."""
+        with self.lock:
+            if self.map is None:
+                if time.monotonic() - self.last_open < self.reopen_every or not self._open():
+                    return None
+            frame = self._read_frame()
+            if (frame is None or time.time() - frame["timestamp"] > self.stale_after) and \
+                    time.monotonic() - self.last_open >= self.reopen_every:
+                # Maybe measure.py restarted with a new segment
+                if self._open():
+                    fresh = self._read_frame()
+                    if fresh is not None:
+                        frame = fresh
+            return frame
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.map = None
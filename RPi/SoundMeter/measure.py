@@ -1,14 +1,24 @@
-import sounddevice as sd  # type: ignore
 import numpy as np
-from scipy.signal import bilinear, lfilter, butter, sosfilt
+from scipy.signal import bilinear, lfilter, butter, ellip, sosfilt
+from functools import lru_cache
 import time
+import threading
+import queue
+import collections
+import signal as sig
 import tkinter as tk
 from tkinter import ttk
 import os
+import json
 from datetime import datetime
 import csv
 import struct
 from pathlib import Path
+import measure_format
+import live_frame
+import metrics
+import rollups
+import narrowband
 
 
 CENTRAL_FREQS = np.array([
@@ -54,42 +64,224 @@ CALIBRATION_CORRECTION_DB = {
 
 after_id = None
 
-BUFFER = []
 SAMPLERATE = 48000
+BUFFER_SECONDS = 10
+RECORD_QUEUE_SIZE = 600
+FLUSH_INTERVAL = 5.0
+FSYNC_INTERVAL = 60.0
+RESYNC_SECONDS = 2.0
+SLEW_SECONDS = 60.0     # time constant of the sample clock offset correction
+MAX_SLEW = 500e-6       # records stay 1 s +/- 0.5 ms apart while the offset is corrected
+RATE_SECONDS = 60.0
+RATE_TOLERANCE = 1e-3
+EVENT_PRE_SECONDS = 5
+EVENT_POST_SECONDS = 5
+EVENT_MAX_PER_HOUR = 6
+EVENT_MAX_BYTES = 500 * 1024**2
 
 MEMORY_LENGHT = 5  
 MEMORY_BUUFER = []
 
+TIME_CONSTANTS = {"Fast": 0.125, "Slow": 1.0, "Impulse": 0.035}
+SHORT_COLUMNS = ["LAeq", "LAFmax", "LAFmin", "LCpeak", "SPL_A", "SPL_C", "SPL_Z"]
+SHORT_WEIGHTING = {"LAeq": "A", "LAFmax": "A", "LAFmin": "A", "LCpeak": "C", "SPL_A": "A", "SPL_C": "C", "SPL_Z": "Z"}
+IMPULSE_DECAY = 1.5
+
+class RingBuffer:
+    """
+    Fixed-capacity float32 buffer between the audio callback and the DSP loop,
+    one column per channel. The callback copies each (frames x channels) chunk
+    in with one slice assignment (two when it wraps). The consumer reads blocks as views, which stay contiguous when
+    the capacity is a multiple of the block length, and releases them with
+    advance(). Chunks that do not fit are dropped and counted as overruns;
+    their position is kept so that stream_index() still counts the lost
+    samples and the timestamps after an overrun stay on the sample clock.
+    """
+
+    def __init__(self, capacity, channels=1, dtype=np.float32):
+        self.capacity = int(capacity)
+        self.channels = channels
+        self.data = np.zeros((self.capacity, channels), dtype=dtype)
+        self.written = 0
+        self.read = 0
+        self.overruns = 0
+        self.dropped_samples = 0
+        self.underruns = 0
+        self.gaps = collections.deque()     # (position in the buffer, samples lost there)
+        self.skipped = 0                    # samples lost before the read position
+
+    def __len__(self):
+        return self.written - self.read
+
+    def write(self, chunk):
+        n = len(chunk)
+        if n > self.capacity - len(self):
+            self.overruns += 1
+            self.dropped_samples += n
+            self.gaps.append((self.written, n))
+            return False
+        start = self.written % self.capacity
+        first = min(n, self.capacity - start)
+        self.data[start:start + first] = chunk[:first]
+        if first < n:
+            self.data[:n - first] = chunk[first:]
+        self.written += n
+        return True
+
+    def read_view(self, n):
+        """Return the next n frames (n x channels) without consuming them, None (underrun) if not available yet."""
+        if len(self) < n:
+            self.underruns += 1
+            return None
+        start = self.read % self.capacity
+        if start + n <= self.capacity:
+            return self.data[start:start + n]
+        return np.concatenate((self.data[start:], self.data[:start + n - self.capacity]))
+
+    def advance(self, n):
+        self.read += min(n, len(self))
+
+    def stream_index(self):
+        """Index in the audio stream (lost samples included) of the next frame to read."""
+        while self.gaps and self.gaps[0][0] <= self.read:
+            self.skipped += self.gaps.popleft()[1]
+        return self.read + self.skipped
+
+    def captured(self):
+        """Samples delivered by the stream so far, lost ones included."""
+        return self.written + self.dropped_samples
+
+class SampleClock:
+    """
+    Epoch time of the samples of the stream. The anchor comes from the first
+    audio callback (ADC time of its first sample) and the samples are then
+    counted, so consecutive blocks are stamped one block apart whatever the
+    scheduling jitter. The ADC times of the following callbacks give the
+    actual sample rate of the converter (over at least RATE_SECONDS) and the
+    offset between the system clock and the sample clock; the offset is
+    corrected gradually by running the clock up to max_slew faster or
+    slower, never by stepping it back, so records stay one second apart to
+    max_slew. Only a sample clock more than resync_after seconds behind
+    (stalled stream, system clock set forward) is stepped, forward and by
+    whole seconds so the records keep their sub-second phase. A system
+    clock set back is caught up at max_slew as well (about half an hour per
+    second), the remaining offset shows as soundmeter_clock_drift_seconds.
+    """
+
+    def __init__(self, sample_rate=SAMPLERATE, resync_after=RESYNC_SECONDS, slew_seconds=SLEW_SECONDS,
+                 max_slew=MAX_SLEW):
+        self.sample_rate = sample_rate
+        self.resync_after = resync_after
+        self.slew_seconds = slew_seconds
+        self.max_slew = max_slew
+        self.period = 1.0 / sample_rate     # measured seconds per sample
+        self.slew = 0.0
+        # (index, time, seconds per sample), replaced as a whole since the DSP thread reads it
+        self.params = None
+        self.base = None                    # (index, time) the sample rate is measured from
+        self.drift = 0.0
+        self.drift_sum = 0.0
+        self.drift_count = 0
+        self.resyncs = 0
+        self.last_stamp = None
+        self.last_index = None
+
+    def observe(self, first_sample, frames, time_info, now):
+        """Callback side: first_sample is the stream index of the first frame of the chunk."""
+        adc = getattr(time_info, "inputBufferAdcTime", 0)
+        current = getattr(time_info, "currentTime", 0)
+        if adc > 0 and current >= adc:
+            start = now - (current - adc)
+        else:
+            # No usable ADC time from the driver: the chunk has just been captured
+            start = now - frames / self.sample_rate
+        if self.params is None:
+            self.params = (first_sample, start, self.period)
+            self.base = (first_sample, start)
+            return
+        self.drift = start - self.time_of(first_sample)
+        if self.drift > self.resync_after:
+            shift = int(self.drift)
+            self.params = (first_sample, self.time_of(first_sample) + shift, self.params[2])
+            self.drift -= shift
+            self.base = (first_sample, start)
+            self.drift_sum, self.drift_count = 0.0, 0
+            self.resyncs += 1
+            return
+        self.drift_sum += self.drift
+        self.drift_count += 1
+        if first_sample - self.params[0] >= self.sample_rate:
+            self._adjust(first_sample, start)
+
+    def _adjust(self, index, start):
+        # Once per second of audio: new rate estimate and slew from the mean offset
+        base_index, base_time = self.base
+        if index - base_index >= RATE_SECONDS * self.sample_rate:
+            period = (start - base_time) / (index - base_index)
+            if abs(period * self.sample_rate - 1) < RATE_TOLERANCE:
+                self.period = period
+            else:
+                # The system clock was set meanwhile: measure again from here
+                self.base = (index, start)
+        drift = self.drift_sum / self.drift_count
+        self.slew = drift / self.slew_seconds
+        # Rate and correction together stay within max_slew of the nominal second
+        nominal = 1.0 / self.sample_rate
+        step = min(max(self.period * (1 + self.slew), nominal * (1 - self.max_slew)), nominal * (1 + self.max_slew))
+        self.params = (index, self.time_of(index), step)
+        self.drift_sum, self.drift_count = 0.0, 0
+
+    def ensure_anchor(self, captured, now):
+        # Without callbacks (buffer filled directly), the latest sample is taken as captured now
+        if self.params is None:
+            start = now - captured / self.sample_rate
+            self.params = (0, start, self.period)
+            self.base = (0, start)
+
+    def time_of(self, index):
+        first, start, step = self.params
+        return start + (index - first) * step
+
+    def stamp(self, index):
+        """time_of(index) for a record, always after the previous stamp."""
+        timestamp = self.time_of(index)
+        if self.last_stamp is not None and timestamp <= self.last_stamp:
+            timestamp = self.last_stamp + max(index - self.last_index, 1) / self.sample_rate
+        self.last_stamp, self.last_index = timestamp, index
+        return timestamp
+
+BUFFER = RingBuffer(BUFFER_SECONDS * SAMPLERATE)
+CLOCK = SampleClock(SAMPLERATE)
+DATA_READY = threading.Event()
+METRICS = metrics.Metrics()
+
 def audio_callback(indata, frames, time_info, status):
-    global BUFFER
     if status:
         print("[Stream audio] Erreur : ", status)
-    BUFFER.extend(indata[:, 0]) 
+        for flag in metrics.CALLBACK_FLAGS:
+            if getattr(status, flag, False):
+                METRICS.inc("soundmeter_callback_status_total", flag=flag)
+    CLOCK.observe(BUFFER.captured(), frames, time_info, time.time())
+    BUFFER.write(indata)
+    DATA_READY.set()
 
-def record_audio(lenght, sample_rate=48000, channel=1):
-    audio = sd.rec(int(lenght * sample_rate), samplerate=sample_rate, channels=channel)
+def record_audio(lenght, sample_rate=48000, channel=1, device=None):
+    import sounddevice as sd  # type: ignore
+    audio = sd.rec(int(lenght * sample_rate), samplerate=sample_rate, channels=channel, device=device)
     sd.wait()
-    return audio.flatten()
-
-def time_pond(signal, tau, sample_rate=48000):
-    alpha = 1 / (tau * sample_rate)
-    alpha = min(alpha, 1.0)
-    power = signal**2
-    output = np.zeros_like(power)
-    output[0] = power[0]
-    for i in range(1, len(power)):
-        output[i] = (1 - alpha) * output[i - 1] + alpha * power[i]
-    return np.sqrt(np.mean(output))
+    return audio.flatten() if channel == 1 else audio.T
 
 def compute_rms(signal):
-    return np.sqrt(np.mean(signal**2))
+    return np.sqrt(np.mean(signal**2, axis=-1))
 
 def mic_calibration(mes_rms, ref_SPL=94):
     p_ref = 20e-6
     ref_pressure = p_ref * 10**(ref_SPL / 20)
     return ref_pressure / mes_rms
 
-def filter_pond(signal, type="A", sample_rate=48000):
+@lru_cache(maxsize=None)
+def weighting_coefficients(type="A", sample_rate=48000):
+    # Bilinear design of the IEC 61672 A/C curves, done once per (type, sample rate)
     if type == "A":
         f1, f2, f3, f4 = 20.598997, 107.65265, 737.86223, 12194.217
         A1000 = 1.9997
@@ -97,20 +289,190 @@ def filter_pond(signal, type="A", sample_rate=48000):
         dens = np.polymul([1, 4*np.pi*f4, (2*np.pi*f4)**2],
                           [1, 4*np.pi*f1, (2*np.pi*f1)**2])
         dens = np.polymul(np.polymul(dens, [1, 2*np.pi*f3]), [1, 2*np.pi*f2])
-        b, a = bilinear(nums, dens, sample_rate)
-        return lfilter(b, a, signal)
+        return bilinear(nums, dens, sample_rate)
     elif type == "C":
         f1, f4, C1000 = 20.598997, 12194.217, 0.0619
         nums = [(2*np.pi*f4)**2 * (10**(C1000/20)), 0, 0]
         dens = np.polymul([1, 4*np.pi*f4, (2*np.pi*f4)**2],
                           [1, 4*np.pi*f1, (2*np.pi*f1)**2])
-        b, a = bilinear(nums, dens, sample_rate)
-        return lfilter(b, a, signal)
+        return bilinear(nums, dens, sample_rate)
     elif type == "Z":
-        return signal
+        return None
     else:
         raise ValueError("Unrecognized ponderation type")
 
+def filter_pond(signal, type="A", sample_rate=48000):
+    coeffs = weighting_coefficients(type, sample_rate)
+    if coeffs is None:
+        return signal
+    b, a = coeffs
+    return lfilter(b, a, signal)
+
+class WeightingFilter:
+    """
+    Frequency weighting (A, C or Z) that keeps its filter state between blocks.
+    Blocks are (samples,) or (channels, samples); filtering runs along the last axis.
+    """
+
+    def __init__(self, type="A", sample_rate=SAMPLERATE):
+        self.type = type
+        self.sample_rate = sample_rate
+        self.coeffs = weighting_coefficients(type, sample_rate)
+        self.reset()
+
+    def reset(self):
+        self.zi = None
+
+    def process(self, block):
+        if self.coeffs is None:
+            return block
+        b, a = self.coeffs
+        if self.zi is None or self.zi.shape[:-1] != block.shape[:-1]:
+            self.zi = np.zeros(block.shape[:-1] + (max(len(a), len(b)) - 1,))
+        out, self.zi = lfilter(b, a, block, axis=-1, zi=self.zi)
+        return out
+
+def power_to_db(mean_square, factor):
+    return 10 * np.log10(mean_square * factor**2 / (20e-6)**2)
+
+class TimeWeightingDetector:
+    """
+    Exponential time weighting (IEC 61672) of a frequency-weighted signal.
+    Fast and Slow run sample by sample through lfilter; Impulse (35 ms rise,
+    1.5 s decay) runs on the mean power of short sub-blocks, all channels at
+    once. The detector state is carried from one block to the next.
+    """
+
+    def __init__(self, type_temp="Fast", sample_rate=SAMPLERATE, impulse_step=0.001):
+        if type_temp not in TIME_CONSTANTS:
+            raise ValueError("Unrecognized time ponderation type")
+        self.type_temp = type_temp
+        self.sample_rate = sample_rate
+        tau = TIME_CONSTANTS[type_temp]
+        if type_temp == "Impulse":
+            self.step = max(1, int(round(impulse_step * sample_rate)))
+            self.alpha_rise = 1 - np.exp(-self.step / (tau * sample_rate))
+            self.alpha_fall = 1 - np.exp(-self.step / (IMPULSE_DECAY * sample_rate))
+        else:
+            self.step = 1
+            self.alpha = 1 - np.exp(-1 / (tau * sample_rate))
+        self.reset()
+
+    def reset(self):
+        self.state = None
+        self.envelope = np.array([])
+        self.pending = None
+
+    def process(self, block):
+        """Run one block through the detector, returns the mean-square envelope (one value per step)."""
+        power = np.asarray(block, dtype=np.float64)**2
+        if self.state is None:
+            self.state = np.mean(power, axis=-1) if power.shape[-1] else np.zeros(power.shape[:-1])
+        if self.type_temp == "Impulse":
+            self.envelope = self._impulse(power)
+        else:
+            a = self.alpha
+            zi = np.asarray((1 - a) * self.state)[..., None]
+            self.envelope, _ = lfilter([a], [1.0, a - 1.0], power, axis=-1, zi=zi)
+        if self.envelope.shape[-1]:
+            self.state = self.envelope[..., -1].copy()
+        return self.envelope
+
+    def _impulse(self, power):
+        if self.pending is not None and self.pending.shape[-1]:
+            power = np.concatenate((self.pending, power), axis=-1)
+        n = power.shape[-1] // self.step
+        self.pending = power[..., n * self.step:]
+        means = power[..., :n * self.step].reshape(power.shape[:-1] + (n, self.step)).mean(axis=-1)
+        out = np.empty_like(means)
+        y, rise, fall = np.array(self.state, dtype=np.float64), self.alpha_rise, self.alpha_fall
+        for i in range(n):
+            p = means[..., i]
+            y = y + np.where(p > y, rise, fall) * (p - y)
+            out[..., i] = y
+        return out
+
+    def level_db(self, factor):
+        return power_to_db(0.0 if self.state is None else self.state, factor)
+
+    def max_db(self, factor):
+        if not self.envelope.shape[-1]:
+            return self.level_db(factor)
+        return power_to_db(np.max(self.envelope, axis=-1), factor)
+
+    def min_db(self, factor):
+        if not self.envelope.shape[-1]:
+            return self.level_db(factor)
+        return power_to_db(np.min(self.envelope, axis=-1), factor)
+
+class StreamingWeighting:
+    """
+    Single pass A/C/Z weighting of the incoming blocks.
+    Each sample is filtered once per weighting; the weighted output feeds the
+    LAeq and the time-weighting detectors, so no signal history is stored.
+    With (channels, samples) blocks every level comes out per channel.
+    """
+
+    def __init__(self, sample_rate=SAMPLERATE, type_temp="Fast"):
+        self.sample_rate = sample_rate
+        self.filters = {t: WeightingFilter(t, sample_rate) for t in ("A", "C", "Z")}
+        self.detectors = {t: TimeWeightingDetector(type_temp, sample_rate) for t in self.filters}
+        # LAFmax / LAFmin always come from the A-weighted Fast detector
+        if type_temp == "Fast":
+            self.fast_A = self.detectors["A"]
+        else:
+            self.fast_A = TimeWeightingDetector("Fast", sample_rate)
+        self.peak_C = 0.0
+
+    def process(self, block):
+        weighted = {}
+        for t, filt in self.filters.items():
+            out = filt.process(block)
+            self.detectors[t].process(out)
+            weighted[t] = out
+        if self.fast_A is not self.detectors["A"]:
+            self.fast_A.process(weighted["A"])
+        self.peak_C = np.max(np.abs(weighted["C"]), axis=-1) if block.shape[-1] else np.zeros(block.shape[:-1])
+        return weighted
+
+    def levels(self, factor):
+        """Time-weighted levels at the end of the last block, with its LAFmax, LAFmin and LCpeak."""
+        return {
+            "SPL_A": self.detectors["A"].level_db(factor),
+            "SPL_C": self.detectors["C"].level_db(factor),
+            "SPL_Z": self.detectors["Z"].level_db(factor),
+            "LAFmax": self.fast_A.max_db(factor),
+            "LAFmin": self.fast_A.min_db(factor),
+            "LCpeak": 20 * np.log10(self.peak_C * factor / 20e-6),
+        }
+
+    def interval_levels(self, weighted, factor, parts):
+        """
+        Levels of each of the parts equal intervals of the last block, taken
+        from its weighted signals (as returned by process) and the detector
+        envelopes: short LAeq, LAFmax, LAFmin and LCpeak of the interval and
+        the time-weighted SPL_A/C/Z at its end. {name: (..., parts)}
+        """
+        factor = np.asarray(factor, dtype=np.float64)
+        if factor.ndim:
+            factor = factor[..., None]
+
+        def split(x):
+            return x.reshape(x.shape[:-1] + (parts, x.shape[-1] // parts))
+
+        fast = split(self.fast_A.envelope)
+        out = {
+            "LAeq": power_to_db(np.mean(split(weighted["A"])**2, axis=-1), factor),
+            "LAFmax": power_to_db(fast.max(axis=-1), factor),
+            "LAFmin": power_to_db(fast.min(axis=-1), factor),
+            "LCpeak": 20 * np.log10(np.max(np.abs(split(weighted["C"])), axis=-1) * factor / 20e-6),
+        }
+        for t, detector in self.detectors.items():
+            # Last envelope value of each interval (Impulse has one value per step, not per sample)
+            n = detector.envelope.shape[-1]
+            out[f"SPL_{t}"] = power_to_db(detector.envelope[..., np.arange(1, parts + 1) * n // parts - 1], factor)
+        return out
+
 def signal_to_db_pond(signal, conversion_factor, tau, freq_pond_type):
     global MEMORY_BUUFER
     MEMORY_BUUFER = np.concatenate((MEMORY_BUUFER, signal))
@@ -135,24 +497,113 @@ def octave_band_filter(f_center, fs, order=4):
     sos = butter(order, [f_min, f_max], btype='bandpass', fs=fs, output='sos')
     return sos
 
-def band_analysis(signal, fs, factor, correction_table=CALIBRATION_CORRECTION_DB):
-    SPL_levels = []
+@lru_cache(maxsize=None)
+def third_octave_design(fs, freqs, order=4):
+    """
+    Split the bands into octave stages running at fs / 2**k.
+    Each band goes to the lowest rate where its upper edge stays below a
+    quarter of the stage sample rate. Returns one dict per stage with the
+    anti-aliasing low-pass used to enter the stage and the band filters.
+    """
     nyquist = fs / 2
-    for f_center in CENTRAL_FREQS:
+    stage_of = {}
+    for i, f_center in enumerate(freqs):
         f_max = f_center * (2 ** (1/6))
         if f_max < nyquist or f_center == 20000:
-            sos = octave_band_filter(f_center, fs)
-            filtered_signal = sosfilt(sos, signal)
-            spl = signal_to_db_spl(filtered_signal, factor)
-            correction = correction_table.get(f_center, 0.0)
-            SPL_levels.append(spl - correction)
-        else:
-            SPL_levels.append(np.nan)
-    return SPL_levels
+            k = 0
+            while f_max <= fs / 2**(k + 1) / 4:
+                k += 1
+            stage_of[i] = k
+
+    n_stages = max(stage_of.values()) + 1 if stage_of else 1
+    # Same normalised design for every halving: cut-off at 0.6 x the new Nyquist,
+    # scaled to unity DC gain so the ripple does not pile up over the stages
+    lowpass = ellip(8, 0.01, 90, 0.3, output='sos')
+    lowpass[0, :3] /= np.prod(lowpass[:, :3].sum(axis=1) / lowpass[:, 3:].sum(axis=1))
+    stages = []
+    for k in range(n_stages):
+        rate = fs / 2**k
+        bands = [(i, octave_band_filter(freqs[i], rate, order)) for i, s in stage_of.items() if s == k]
+        stages.append({"rate": rate, "lowpass": lowpass if k > 0 else None, "bands": bands})
+    return stages
+
+class ThirdOctaveFilterBank:
+    """
+    Multirate 1/3-octave filter bank, designed once at startup.
+    The signal is low-passed and halved from one octave stage to the next so
+    the low bands run at a fraction of fs. Filter and decimation states are
+    kept between blocks. Bands above Nyquist are returned as NaN.
+    A (channels, samples) block gives one list of band levels per channel.
+    """
+
+    def __init__(self, fs=SAMPLERATE, freqs=CENTRAL_FREQS, correction_table=CALIBRATION_CORRECTION_DB, order=4):
+        self.fs = fs
+        self.freqs = np.asarray(freqs)
+        self.correction = np.array([correction_table.get(f, 0.0) for f in self.freqs])
+        self.stages = third_octave_design(fs, tuple(float(f) for f in self.freqs), order)
+        self.reset()
+
+    def reset(self, channel_shape=()):
+        self.channel_shape = channel_shape
+        self.zi_lowpass = [None if st["lowpass"] is None else np.zeros((st["lowpass"].shape[0],) + channel_shape + (2,))
+                           for st in self.stages]
+        self.phase = [0] * len(self.stages)
+        self.zi_bands = {i: np.zeros((sos.shape[0],) + channel_shape + (2,))
+                         for st in self.stages for i, sos in st["bands"]}
+
+    def process(self, signal, factor, parts=None):
+        """
+        Band levels of the block, one list per channel. With parts, the levels
+        of that many equal intervals of the block are returned as well, as an
+        array (..., parts, bands) computed from the same filter outputs.
+        """
+        x = np.asarray(signal, dtype=np.float64)
+        if x.shape[:-1] != self.channel_shape:
+            self.reset(x.shape[:-1])
+        factor = np.asarray(factor, dtype=np.float64)
+        if factor.ndim:
+            factor = factor[..., None]
+        mean_square = np.full(x.shape[:-1] + (len(self.freqs),), np.nan)
+        if parts:
+            part_square = np.full(x.shape[:-1] + (parts, len(self.freqs)), np.nan)
+        for k, stage in enumerate(self.stages):
+            if k > 0:
+                x, self.zi_lowpass[k] = sosfilt(stage["lowpass"], x, axis=-1, zi=self.zi_lowpass[k])
+                # Keep every other sample, with the parity carried across blocks
+                start = self.phase[k]
+                self.phase[k] = (start - x.shape[-1]) % 2
+                x = x[..., start::2]
+            for i, sos in stage["bands"]:
+                y, self.zi_bands[i] = sosfilt(sos, x, axis=-1, zi=self.zi_bands[i])
+                if y.shape[-1]:
+                    mean_square[..., i] = np.mean(y**2, axis=-1)
+                if parts:
+                    part_square[..., i] = interval_means(y**2, parts)
+        SPL_levels = power_to_db(mean_square, factor) - self.correction
+        if parts:
+            return SPL_levels.tolist(), power_to_db(part_square, factor[..., None]) - self.correction
+        return SPL_levels.tolist()
+
+def interval_means(x, parts):
+    """
+    Mean of x over parts consecutive intervals of the last axis. The
+    decimated stages of the filter bank do not always have a multiple of
+    parts samples per block, so the bounds are rounded; an empty interval
+    gives NaN.
+    """
+    bounds = np.rint(np.linspace(0, x.shape[-1], parts + 1)).astype(np.int64)
+    cum = np.concatenate((np.zeros(x.shape[:-1] + (1,)), np.cumsum(x, axis=-1)), axis=-1)
+    counts = np.diff(bounds)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, (cum[..., bounds[1:]] - cum[..., bounds[:-1]]) / counts, np.nan)
+
+def band_analysis(signal, fs, factor, correction_table=CALIBRATION_CORRECTION_DB):
+    return ThirdOctaveFilterBank(fs, correction_table=correction_table).process(signal, factor)
 
-def save_complete_CSV(levels_and_pond, csv_file):
+def save_complete_CSV(levels_and_pond, csv_file, timestamp=None):
     try:
-        date_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        moment = datetime.now() if timestamp is None else datetime.fromtimestamp(timestamp)
+        date_time = moment.strftime("%Y-%m-%d %H:%M:%S")
         line = [date_time] + levels_and_pond
 
         if not os.path.exists(csv_file):
@@ -170,10 +621,12 @@ def save_complete_CSV(levels_and_pond, csv_file):
 
 
 def save_calibration(factor, file="calibration.txt"):
+    # One factor per channel, comma separated on the first line
     filepath = os.path.join(os.path.dirname(__file__), file)
     with open(filepath, "w") as f:
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        f.write(f"{factor}\n{now}")
+        factors = ",".join(str(float(v)) for v in np.atleast_1d(factor))
+        f.write(f"{factors}\n{now}")
 
 def load_calibration(file="calibration.txt"):
     filepath = os.path.join(os.path.dirname(__file__), file)
@@ -181,8 +634,9 @@ def load_calibration(file="calibration.txt"):
         with open(filepath, "r") as f:
             lines = f.readlines()
             if len(lines) >= 2:
-                factor = float(lines[0].strip())
+                factors = [float(v) for v in lines[0].strip().split(",")]
                 date = lines[1].strip()
+                factor = factors[0] if len(factors) == 1 else np.array(factors)
                 return factor, date
     return None, None
 
@@ -202,108 +656,633 @@ def compute_LAeq_1s(signal, factor, sample_rate=48000):
     LAeq_1s = 20 * np.log10(p_rms_A / 20e-6)
     return LAeq_1s
 
-def launch_measure(type_temp="Fast", recalibrate=False, range="normale", save=True):
-    if type_temp == "Fast":
-        tau = 0.125
-    elif type_temp == "Slow":
-        tau = 1.0
-    elif type_temp == "Impulse": # Pas encore au point
-        tau = 0.035
+class HourlyWriter:
+    """
+    Keeps the hourly CSV and .bin of one channel open for the whole hour.
+    Records are batched in memory and written + flushed every flush_interval
+    seconds, fsynced every fsync_interval seconds, and flushed, synced and
+    closed when the hour rolls over or on close().
+    With csv=False only the .bin is written (the sub-second records, see
+    write_many).
+    """
+
+    def __init__(self, meas_dir, metadata, prefix="mesures",
+                 flush_interval=FLUSH_INTERVAL, fsync_interval=FSYNC_INTERVAL, metrics=None, csv=True):
+        self.meas_dir = meas_dir
+        self.metrics = metrics
+        self.with_csv = csv
+        self.metadata = metadata
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.columns = list(metadata["columns"])
+        self.scale = metadata.get("scale", measure_format.SCALE)
+        self.dtype = measure_format.record_dtype(len(self.columns))
+        self.csv = None
+        self.bin = None
+        self.csv_path = None
+        self.bin_path = None
+        self.hour_start = None
+        self.hour_end = None
+        self.csv_pending = []
+        self.bin_pending = []
+        self.last_flush = time.monotonic()
+        self.last_fsync = self.last_flush
+
+    def _open(self, timestamp):
+        self.close()
+        moment = datetime.fromtimestamp(timestamp).replace(minute=0, second=0, microsecond=0)
+        self.hour_start = moment.timestamp()
+        self.hour_end = self.hour_start + 3600
+        self.clock_prefix = moment.strftime("%Y-%m-%d %H:")
+        horodatage = moment.strftime("%Y-%m-%d_%H")
+        self.bin_path = measure_format.prepare_for_append(
+            os.path.join(self.meas_dir, f"{self.prefix}_{horodatage}.bin"), self.metadata)
+        self.bin = open(self.bin_path, "ab")
+        if not self.with_csv:
+            print(f" New time : generating {Path(self.bin_path).name}")
+            return
+
+        self.csv_path = os.path.join(self.meas_dir, f"{self.prefix}_{horodatage}.csv")
+        new_csv = not os.path.exists(self.csv_path) or os.path.getsize(self.csv_path) == 0
+        self.csv = open(self.csv_path, mode='a', newline='')
+        if new_csv:
+            self.csv.write(",".join(['Date&Time'] + self.columns) + "\r\n")
+        print(f" New time : generating {Path(self.csv_path).name}")
+
+    def write(self, timestamp, line):
+        if self.bin is None or not (self.hour_start <= timestamp < self.hour_end):
+            self._open(timestamp)
+        # Same text as strftime("%Y-%m-%d %H:%M:%S") without formatting a datetime every second
+        offset = int(timestamp - self.hour_start)
+        date_time = f"{self.clock_prefix}{offset // 60:02d}:{offset % 60:02d}"
+        self.csv_pending.append(",".join([date_time] + [str(v) for v in line]) + "\r\n")
+        values = np.round(np.array(line) * self.scale).astype(np.int16)
+        self.bin_pending.append(measure_format.encode_record(timestamp, values, self.dtype))
+        self.tick()
+
+    def write_many(self, timestamps, lines):
+        """Records in time order (lines is an array, one row per timestamp) to the .bin, encoded in one batch per hour."""
+        i = 0
+        while i < len(timestamps):
+            if self.bin is None or not (self.hour_start <= timestamps[i] < self.hour_end):
+                self._open(timestamps[i])
+            j = i + int(np.searchsorted(timestamps[i:], self.hour_end))
+            values = np.round(np.asarray(lines[i:j]) * self.scale).astype(np.int16)
+            self.bin_pending.append(measure_format.encode_records(timestamps[i:j], values, self.dtype))
+            i = j
+        self.tick()
+
+    def tick(self):
+        now = time.monotonic()
+        if now - self.last_flush >= self.flush_interval:
+            self.flush(fsync=now - self.last_fsync >= self.fsync_interval)
+
+    def flush(self, fsync=False):
+        if self.bin is None:
+            return
+        start = time.perf_counter()
+        try:
+            if self.csv_pending:
+                self.csv.write("".join(self.csv_pending))
+            if self.bin_pending:
+                self.bin.write(b"".join(self.bin_pending))
+            self.bin.flush()
+            if self.csv is not None:
+                self.csv.flush()
+            if fsync:
+                os.fsync(self.bin.fileno())
+                if self.csv is not None:
+                    os.fsync(self.csv.fileno())
+                self.last_fsync = time.monotonic()
+        except Exception as e:
+            print(f"Error while saving measurement files : {e}")
+        self.csv_pending = []
+        self.bin_pending = []
+        self.last_flush = time.monotonic()
+        if self.metrics is not None:
+            self.metrics.observe("soundmeter_flush_seconds", time.perf_counter() - start,
+                                 fsync=str(bool(fsync)).lower())
+
+    def close(self):
+        if self.bin is None:
+            return
+        self.flush(fsync=True)
+        if self.csv is not None:
+            self.csv.close()
+        self.bin.close()
+        self.csv = None
+        self.bin = None
+
+class EventRecorder:
+    """
+    Audio snippets of the loud events.
+    The DSP loop hands over every block with its levels. The last
+    pre_seconds of raw audio are kept in a RingBuffer; when the LAeq,1s or
+    LAFmax of a channel goes over its threshold (fixed values, and/or the
+    period limit of a PeriodSchedule plus margin) the pre-trigger audio, the
+    triggering block and post_seconds more are written as one WAV file
+    (int16, all channels) with a JSON sidecar, by a background thread.
+    The DSP side only copies blocks and queues finished events without
+    waiting: events beyond max_per_hour, or when the writer is busy, are
+    dropped, and nothing is written once the event directory holds max_bytes.
+    """
+
+    def __init__(self, directory, factor, sample_rate=SAMPLERATE, channels=1, laeq_limit=None,
+                 lafmax_limit=None, schedule=None, margin=0.0, pre_seconds=EVENT_PRE_SECONDS,
+                 post_seconds=EVENT_POST_SECONDS, max_per_hour=EVENT_MAX_PER_HOUR,
+                 max_bytes=EVENT_MAX_BYTES, metrics=None):
+        self.directory = directory
+        self.factor = np.broadcast_to(np.asarray(factor, dtype=np.float64), (channels,))
+        self.sample_rate = sample_rate
+        self.laeq_limit = laeq_limit
+        self.lafmax_limit = lafmax_limit
+        self.schedule = schedule
+        self.margin = margin
+        self.post_blocks = int(post_seconds)
+        self.max_per_hour = max_per_hour
+        self.max_bytes = max_bytes
+        self.metrics = metrics
+        self.history = RingBuffer(int(pre_seconds * sample_rate), channels=channels)
+        self.current = None
+        self.recent = collections.deque()
+        self.counts = collections.Counter()
+        os.makedirs(directory, exist_ok=True)
+        self.used_bytes = sum(e.stat().st_size for e in os.scandir(directory) if e.is_file())
+        self.pending = queue.Queue(maxsize=2)
+        self.thread = threading.Thread(target=self._writer_loop, name="events", daemon=True)
+        self.thread.start()
+
+    def _count(self, result):
+        self.counts[result] += 1
+        if self.metrics is not None:
+            self.metrics.inc("soundmeter_events_total", result=result)
+
+    def check(self, timestamp, LAeq, LAFmax):
+        """(channel, reason, level, limit) of the first threshold exceeded, None if none is."""
+        period_limit = self.schedule.limit_at(timestamp) + self.margin if self.schedule is not None else None
+        for c in range(len(LAeq)):
+            for name, level, limit in (("LAeq", LAeq[c], self.laeq_limit), ("LAeq", LAeq[c], period_limit),
+                                       ("LAFmax", LAFmax[c], self.lafmax_limit)):
+                if limit is not None and limit == limit and level > limit:
+                    return c, name, float(level), float(limit)
+        return None
+
+    def process(self, block, timestamp, LAeq, LAFmax):
+        """One block (samples, channels) ending at timestamp, with the LAeq,1s and LAFmax of each channel."""
+        if self.current is not None:
+            self.current["blocks"].append(block.copy())
+            if len(self.current["blocks"]) > self.post_blocks + 1:
+                self._finish()
+        else:
+            trigger = self.check(timestamp, LAeq, LAFmax)
+            if trigger is not None:
+                self._start(block, timestamp, trigger)
+        # Pre-trigger audio: the oldest samples make room for the new block
+        if self.history.capacity:
+            excess = len(self.history) + len(block) - self.history.capacity
+            if excess > 0:
+                self.history.advance(excess)
+            self.history.write(block[-self.history.capacity:])
+
+    def _start(self, block, timestamp, trigger):
+        while self.recent and self.recent[0] <= timestamp - 3600:
+            self.recent.popleft()
+        if len(self.recent) >= self.max_per_hour:
+            self._count("rate_limited")
+            return
+        self.recent.append(timestamp)
+        channel, name, level, limit = trigger
+        pre = self.history.read_view(len(self.history)).copy()
+        self.current = {
+            "trigger_time": timestamp - len(block) / self.sample_rate,
+            "start_time": timestamp - (len(block) + len(pre)) / self.sample_rate,
+            "channel": channel + 1,
+            "trigger": name,
+            "level": round(level, 1),
+            "limit": round(limit, 1),
+            "blocks": [pre, block.copy()],
+        }
+
+    def _finish(self):
+        event, self.current = self.current, None
+        try:
+            self.pending.put_nowait(event)
+        except queue.Full:
+            self._count("dropped_busy")
+
+    def _writer_loop(self):
+        while True:
+            event = self.pending.get()
+            if event is None:
+                return
+            try:
+                self.write_event(event)
+            except Exception as e:
+                print(f"Error while saving event audio : {e}")
+                self._count("error")
+
+    def write_event(self, event):
+        from scipy.io import wavfile
+        audio = np.concatenate(event.pop("blocks"))
+        samples = np.clip(np.round(audio * 32767), -32768, 32767).astype(np.int16)
+        size = samples.nbytes + 1024
+        if self.used_bytes + size > self.max_bytes:
+            self._count("dropped_disk")
+            return
+        name = "event_" + datetime.fromtimestamp(event["trigger_time"]).strftime("%Y-%m-%d_%H-%M-%S")
+        path = os.path.join(self.directory, name + ".wav")
+        wavfile.write(path + ".tmp", self.sample_rate, samples)
+        os.replace(path + ".tmp", path)
+        event.update(sample_rate=self.sample_rate, duration=len(samples) / self.sample_rate,
+                     calibration_factor=self.factor.tolist(), full_scale=32767)
+        with open(os.path.join(self.directory, name + ".json"), "w") as f:
+            json.dump(event, f, indent=2)
+        self.used_bytes += os.path.getsize(path) + os.path.getsize(os.path.join(self.directory, name + ".json"))
+        self._count("written")
+        print(f" Event : {name}.wav ({event['trigger']} {event['level']} dB > {event['limit']} dB)")
+
+    def close(self):
+        """Write the event in progress (shorter post-trigger part) and wait for the writer."""
+        if self.current is not None:
+            event, self.current = self.current, None
+            self.pending.put(event)
+        self.pending.put(None)
+        self.thread.join()
+
+def interval_parts(interval, sample_rate=SAMPLERATE):
+    """Number of records of interval seconds per one-second block (None for no sub-second records)."""
+    if interval is None:
+        return None
+    parts = int(round(1 / interval))
+    if parts < 1 or abs(parts * interval - 1) > 1e-9 or sample_rate % parts:
+        raise ValueError(f"The record interval must divide one second into whole samples ({interval} s)")
+    return parts
+
+class MeasurementPipeline:
+    """
+    Capture -> DSP -> writer stages: the DSP thread turns each one-second
+    block of the ring buffer into records (and the optional short, spectrum
+    and tonality rows), the writer thread saves them; records are dropped,
+    not waited on, when the writer queue is full.
+    """
+
+    def __init__(self, factor, type_temp="Fast", save=True, meas_dir="measurements",
+                 ring=None, sample_rate=SAMPLERATE, queue_size=RECORD_QUEUE_SIZE,
+                 flush_interval=FLUSH_INTERVAL, fsync_interval=FSYNC_INTERVAL, live=False, verbose=True,
+                 metrics_registry=None, clock=None, short_interval=None, band_interval=None, events=None,
+                 tone_interval=None):
+        self.ring = BUFFER if ring is None else ring
+        self.clock = SampleClock(sample_rate) if clock is None else clock
+        self.metrics = metrics.Metrics() if metrics_registry is None else metrics_registry
+        self.channels = self.ring.channels
+        self.factor = np.broadcast_to(np.asarray(factor, dtype=np.float64), (self.channels,))
+        self.type_temp = type_temp
+        self.save = save
+        self.meas_dir = meas_dir
+        self.sample_rate = sample_rate
+        self.verbose = verbose
+        self.short_parts = interval_parts(short_interval, sample_rate)
+        self.band_parts = interval_parts(band_interval, sample_rate)
+        self.weighting = StreamingWeighting(sample_rate, type_temp=type_temp)
+        self.filter_bank = ThirdOctaveFilterBank(sample_rate)
+        self.records = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.processed_blocks = 0
+        self.dropped_records = 0
+        self.written_records = 0
+        self.writers = []
+        self.rollups = []
+        self.short_writers = []
+        self.spectrum_writers = []
+        self.events = events
+        self.narrowband = None
+        self.tonality = []
+        if tone_interval:
+            self.narrowband = narrowband.NarrowbandAnalyzer(sample_rate, self.channels, self.factor, tone_interval)
+        if save:
+            for c in range(self.channels):
+                # Channel 1 keeps the historical names, the others get a _chN prefix
+                prefix = "mesures" if c == 0 else f"mesures_ch{c + 1}"
+                metadata = self.file_metadata(c)
+                self.writers.append(HourlyWriter(meas_dir, metadata, prefix,
+                                                 flush_interval, fsync_interval, self.metrics))
+                rollup_prefix = "rollup" if c == 0 else f"rollup_ch{c + 1}"
+                self.rollups.append(rollups.RollupWriter(meas_dir, metadata["columns"], rollup_prefix))
+                suffix = "" if c == 0 else f"_ch{c + 1}"
+                if self.short_parts:
+                    self.short_writers.append(HourlyWriter(
+                        meas_dir, self.interval_metadata(c, SHORT_COLUMNS, short_interval, SHORT_WEIGHTING),
+                        f"short{suffix}", flush_interval, fsync_interval, self.metrics, csv=False))
+                if self.narrowband is not None:
+                    self.tonality.append(narrowband.TonalityWriter(
+                        meas_dir, tone_interval, sample_rate=sample_rate, prefix=f"tonality{suffix}"))
+                if self.band_parts:
+                    bands = [name for name in metadata["columns"] if name.endswith("Hz")]
+                    self.spectrum_writers.append(HourlyWriter(
+                        meas_dir, self.interval_metadata(c, bands, band_interval, {"bands": "Z"}),
+                        f"spectrum{suffix}", flush_interval, fsync_interval, self.metrics, csv=False))
+        self.publisher = None
+        if live:
+            # Latest record of channel 1 for the web server, see live_frame
+            try:
+                self.publisher = live_frame.LiveFramePublisher(self.file_metadata(0)["columns"])
+            except OSError as e:
+                print(f"Live frame unavailable : {e}")
+        self.threads = []
+
+    def start(self):
+        self.threads = [
+            threading.Thread(target=self._dsp_loop, name="dsp", daemon=True),
+            threading.Thread(target=self._writer_loop, name="writer", daemon=True),
+        ]
+        for t in self.threads:
+            t.start()
+
+    def stop(self):
+        # The DSP stops first, the writer then empties the queue before leaving
+        self.stop_event.set()
+        DATA_READY.set()
+        for t in self.threads:
+            t.join()
+        if self.publisher is not None:
+            self.publisher.close()
+
+    def is_alive(self):
+        return any(t.is_alive() for t in self.threads)
+
+    def process_block(self, block, timestamp):
+        """block is (samples, channels) as read from the ring buffer; returns one line per channel."""
+        signal = block.T
+        start = time.perf_counter()
+        weighted = self.weighting.process(signal)
+        levels = self.weighting.levels(self.factor)
+        LAeq = signal_to_db_spl(weighted["A"], self.factor)
+        if self.short_parts:
+            short = self.weighting.interval_levels(weighted, self.factor, self.short_parts)
+            levels["short"] = np.stack([short[k] for k in SHORT_COLUMNS], axis=-1)
+        middle = time.perf_counter()
+        if self.band_parts:
+            freq_levels, levels["spectrum"] = self.filter_bank.process(signal, self.factor, self.band_parts)
+        else:
+            freq_levels = self.filter_bank.process(signal, self.factor)
+        self.metrics.observe("soundmeter_stage_seconds", middle - start, stage="weighting")
+        self.metrics.observe("soundmeter_stage_seconds", time.perf_counter() - middle, stage="bands")
+        if self.narrowband is not None:
+            middle = time.perf_counter()
+            # Result of the interval that just closed, None most of the time
+            levels["tonality"] = self.narrowband.add(signal, timestamp)
+            self.metrics.observe("soundmeter_stage_seconds", time.perf_counter() - middle, stage="narrowband")
+
+        lines = []
+        for c in range(self.channels):
+            round_levels = [round(val, 2) for val in freq_levels[c]]
+            spl = [round(float(levels[k][c]), 1) for k in ("SPL_A", "SPL_C", "SPL_Z")]
+            lines.append([round(float(LAeq[c]), 1)] + round_levels + spl)
+        return timestamp, lines, levels
+
+    def _dsp_loop(self):
+        n = self.sample_rate
+        resyncs = self.clock.resyncs
+        while not self.stop_event.is_set():
+            DATA_READY.clear()
+            if len(self.ring) < n:
+                # Nothing for two block durations: the stream itself has stalled
+                if not DATA_READY.wait(2 * n / self.sample_rate) and not self.stop_event.is_set():
+                    self.ring.underruns += 1
+                    print(f"Not enough data. (underruns: {self.ring.underruns}, overruns: {self.ring.overruns})")
+                continue
+
+            self.metrics.observe("soundmeter_dsp_lateness_seconds", (len(self.ring) - n) / self.sample_rate,
+                                 metrics.LATENESS_BUCKETS)
+            start = time.perf_counter()
+            self.clock.ensure_anchor(self.ring.captured(), time.time())
+            if self.clock.resyncs != resyncs:
+                resyncs = self.clock.resyncs
+                print(f"Sample clock stepped forward to the system clock (resync {resyncs})")
+            timestamp = self.clock.stamp(self.ring.stream_index() + n)
+            block = self.ring.read_view(n)
+            try:
+                record = self.process_block(block, timestamp)
+            except Exception as e:
+                print(f"[DSP] Error : {e}")
+                self.metrics.inc("soundmeter_dsp_errors_total")
+                record = None
+            if self.events is not None and record is not None:
+                # Before advance(): block is a view of the ring buffer
+                try:
+                    self.events.process(block, timestamp, [line[0] for line in record[1]], record[2]["LAFmax"])
+                except Exception as e:
+                    print(f"[Events] Error : {e}")
+            self.ring.advance(n)
+            self.processed_blocks += 1
+            self.metrics.observe("soundmeter_stage_seconds", time.perf_counter() - start, stage="dsp")
+            if record is None:
+                continue
+            if self.publisher is not None:
+                self.publisher.publish(record[0], record[1][0])
+            try:
+                self.records.put_nowait(record)
+            except queue.Full:
+                self.dropped_records += 1
+
+    def _writer_loop(self):
+        while True:
+            try:
+                record = self.records.get(timeout=0.5)
+            except queue.Empty:
+                if self.stop_event.is_set() and not any(
+                        t.is_alive() for t in self.threads if t.name == "dsp"):
+                    break
+                for writer in self.writers:
+                    writer.tick()
+                continue
+            self.write_record(*record)
+        self.close_writers()
+
+    def close_writers(self):
+        for writer in self.writers + self.short_writers + self.spectrum_writers:
+            writer.close()
+        if self.events is not None:
+            self.events.close()
+        if self.narrowband is not None:
+            self.write_tonality(self.narrowband.close())
+        for rollup in self.rollups:
+            rollup.close()
+
+    def update_metrics(self):
+        """Copy the counters kept by the ring buffer and the threads into the metrics, once per second."""
+        m = self.metrics
+        m.set("soundmeter_blocks_processed_total", self.processed_blocks)
+        m.set("soundmeter_records_written_total", self.written_records)
+        m.set("soundmeter_records_dropped_total", self.dropped_records)
+        m.set("soundmeter_ring_overruns_total", self.ring.overruns)
+        m.set("soundmeter_ring_dropped_samples_total", self.ring.dropped_samples)
+        m.set("soundmeter_ring_underruns_total", self.ring.underruns)
+        m.set("soundmeter_ring_depth_seconds", len(self.ring) / self.sample_rate)
+        m.set("soundmeter_record_queue_depth", self.records.qsize())
+        m.set("soundmeter_channels", self.channels)
+        m.set("soundmeter_clock_drift_seconds", round(self.clock.drift, 6))
+        m.set("soundmeter_clock_resyncs_total", self.clock.resyncs)
+        m.set("soundmeter_clock_rate_error_ppm", round((1 / (self.clock.period * self.sample_rate) - 1) * 1e6, 2))
+
+    def file_metadata(self, channel):
+        bands = [float(f) for f in self.filter_bank.freqs]
+        return {
+            "columns": measure_format.default_columns(bands),
+            "bands_hz": bands,
+            "sample_rate": self.sample_rate,
+            "calibration_factor": float(self.factor[channel]),
+            "channel": channel + 1,
+            "weighting": {"LAeq": "A", "bands": "Z", "SPL_A": "A", "SPL_C": "C", "SPL_Z": "Z"},
+            "time_weighting": self.type_temp,
+            "scale": measure_format.SCALE,
+            "record_interval": 1.0,
+        }
+
+    def interval_metadata(self, channel, columns, interval, weighting):
+        metadata = self.file_metadata(channel)
+        metadata.update(columns=list(columns), weighting=weighting, record_interval=interval)
+        return metadata
+
+    def write_intervals(self, writers, timestamp, values):
+        """Sub-second records of one block, values (channels, parts, columns); the last one ends at timestamp."""
+        parts = values.shape[1]
+        timestamps = timestamp + np.arange(1 - parts, 1) / parts
+        for writer, channel_values in zip(writers, values):
+            try:
+                writer.write_many(timestamps, channel_values)
+            except Exception as e:
+                print(f"Error while saving measurement files : {e}")
+                self.metrics.inc("soundmeter_write_errors_total")
+
+    def write_tonality(self, result):
+        if result is None:
+            return
+        for writer, tones in zip(self.tonality, result["tones"]):
+            writer.write(result, tones)
+        if self.verbose and result["tones"][0]:
+            tone = result["tones"][0][0]
+            print(f" Tone {tone['frequency']:.0f} Hz : audibility {tone['audibility']:.1f} dB, Kt {tone['kt']:.1f} dB")
+
+    def write_record(self, timestamp, lines, levels):
+        if self.verbose:
+            clock = datetime.fromtimestamp(timestamp).strftime('%H:%M:%S')
+            for c, line in enumerate(lines):
+                LAeq, spl_A, spl_Z = line[0], line[-3], line[-1]
+                channel = f" ch{c + 1}" if self.channels > 1 else ""
+                print(f"{clock}{channel} | LAeq: {LAeq:.1f} dB | A: {spl_A:.1f} dB | Z: {spl_Z:.1f} dB | LAFmax: {levels['LAFmax'][c]:.1f} dB")
+        start = time.perf_counter()
+        for writer, line in zip(self.writers, lines):
+            try:
+                writer.write(timestamp, line)
+            except Exception as e:
+                print(f"Error while saving measurement files : {e}")
+                self.metrics.inc("soundmeter_write_errors_total")
+        for rollup, line in zip(self.rollups, lines):
+            rollup.add(timestamp, line)
+        if self.short_writers:
+            self.write_intervals(self.short_writers, timestamp, levels["short"])
+        if self.spectrum_writers:
+            self.write_intervals(self.spectrum_writers, timestamp, levels["spectrum"])
+        if levels.get("tonality") is not None:
+            self.write_tonality(levels["tonality"])
+        self.written_records += 1
+        self.metrics.observe("soundmeter_stage_seconds", time.perf_counter() - start, stage="write")
+
+def load_period_schedule(path):
+    """PeriodSchedule of the report configuration (PROJECT_CONFIG.json), None if it cannot be read."""
+    import assessment
+    try:
+        with open(path, "r") as f:
+            return assessment.PeriodSchedule.from_config(json.load(f))
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Period limits unavailable : {e}")
+        return None
+
+def _terminate(signum, frame):
+    # SIGTERM (e.g. /stop) goes through the same clean shutdown as Ctrl+C
+    raise KeyboardInterrupt
+
+def launch_measure(type_temp="Fast", recalibrate=False, range="normale", save=True, channels=1, device=None,
+                   flush_interval=FLUSH_INTERVAL, fsync_interval=FSYNC_INTERVAL, short_interval=None,
+                   band_interval=None, event_laeq=None, event_lafmax=None, event_periods=False, event_margin=0.0,
+                   tone_interval=None):
+    global BUFFER, CLOCK
+    # Imported here so that replay, benchmark and reports run without an audio device
+    import sounddevice as sd  # type: ignore
+    if type_temp not in TIME_CONSTANTS:
+        raise ValueError("Unrecognized time ponderation type")
 
     if recalibrate:
-        print("Start calibration (94 dB SPL @ 1 kHz)")
-        time.sleep(10)
-        signal_calibration = record_audio(1)
-        rms_calibration = compute_rms(signal_calibration)
-        factor = mic_calibration(rms_calibration)
+        factor = np.zeros(channels)
+        for c in range(channels):
+            print(f"Start calibration of channel {c + 1} (94 dB SPL @ 1 kHz)")
+            time.sleep(10)
+            signal_calibration = record_audio(1, channel=channels, device=device)
+            if channels > 1:
+                signal_calibration = signal_calibration[c]
+            rms_calibration = compute_rms(signal_calibration)
+            factor[c] = mic_calibration(rms_calibration)
+            print(f"Calibrated conversion factor : {factor[c]:.6f} Pa/unit")
         save_calibration(factor)
-        print(f"Calibrated conversion factor : {factor:.6f} Pa/unit")
     else:
         factor, _ = load_calibration()
         print("Previous calibration loaded.")
         if factor is None:
             print("No calibration found. Calibration is required to proceed.")
             return
+        n_factors = np.size(factor)
+        if n_factors != channels and n_factors != 1:
+            print(f"Calibration has {n_factors} factors for {channels} channels. Calibration is required to proceed.")
+            return
         
     # Create the relevant folders for measurement results
     base_dir = os.path.dirname(__file__)
     meas_dir = os.path.join(base_dir, "measurements")
     os.makedirs(meas_dir, exist_ok=True)   # create if it doesn't exist
 
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-    csv_file = os.path.join(meas_dir, f"mesures_{timestamp}.csv")
-    bin_file = os.path.join(meas_dir, f"mesures_{timestamp}.bin")
-
     if range == "low":
         ymin, ymax = 25, 120
     elif range == "high" : 
         ymin, ymax = 35, 140
     else :
         ymin, ymax = 25, 140
-        
-    def new_files():
-        horodatage = datetime.now().strftime("%Y-%m-%d_%H")   
-        csv_path = Path(meas_dir) / f"mesures_{horodatage}.csv"
-        bin_path = Path(meas_dir) / f"mesures_{horodatage}.bin"
-        return str(csv_path), str(bin_path), horodatage
-
-    csv_file, bin_file, current_time = new_files()
-    
-    stream = sd.InputStream(samplerate=SAMPLERATE, channels=1, callback=audio_callback)
-    stream.start()
-    global MEMORY_BUUFER
-    MEMORY_BUUFER = np.array([], dtype=np.float32)
 
-    start_time = time.monotonic()
-    i = 0
+    BUFFER = RingBuffer(BUFFER_SECONDS * SAMPLERATE, channels=channels)
+    CLOCK = SampleClock(SAMPLERATE)
+    events = None
+    if save and (event_laeq is not None or event_lafmax is not None or event_periods):
+        # Audio snippets of the events, over fixed thresholds and/or the period limits of the report
+        schedule = load_period_schedule(os.path.join(base_dir, "PROJECT_CONFIG.json")) if event_periods else None
+        events = EventRecorder(os.path.join(meas_dir, "events"), factor, SAMPLERATE, channels, event_laeq,
+                               event_lafmax, schedule, event_margin, metrics=METRICS)
+    pipeline = MeasurementPipeline(factor, type_temp=type_temp, save=save, meas_dir=meas_dir, ring=BUFFER,
+                                   flush_interval=flush_interval, fsync_interval=fsync_interval, live=True,
+                                   metrics_registry=METRICS, clock=CLOCK, short_interval=short_interval,
+                                   band_interval=band_interval, events=events, tone_interval=tone_interval)
+    stats = metrics.StatsPublisher()
+    sig.signal(sig.SIGTERM, _terminate)
+    stream = sd.InputStream(samplerate=SAMPLERATE, channels=channels, device=device, callback=audio_callback)
+    pipeline.start()
+    stream.start()
 
     try:
-        while True:
-            target_time = start_time + i
-            now = time.monotonic()
-            clock = datetime.now().strftime("%Y-%m-%d_%H")
-            if clock != current_time:
-                csv_file, bin_file, current_time = new_files()
-                print(f" New time : generating {Path(csv_file).name}")
-
-            sleep_time = target_time - now
-            if sleep_time > 0:
-                time.sleep(sleep_time)
-
-            if len(BUFFER) >= SAMPLERATE:
-                measured_signal = np.array(BUFFER[:SAMPLERATE])
-                BUFFER[:] = BUFFER[SAMPLERATE:]
-
-                LAeq  = round(compute_LAeq_1s(measured_signal, factor),1)
-                spl_A = round(signal_to_db_pond(measured_signal, factor, tau, freq_pond_type="A"), 1)
-                spl_C = round(signal_to_db_pond(measured_signal, factor, tau, freq_pond_type="C"), 1)
-                spl_Z = round(signal_to_db_pond(measured_signal, factor, tau, freq_pond_type="Z"), 1)
-
-                print(f"{datetime.now().strftime('%H:%M:%S')} | LAeq: {LAeq:.1f} dB | A: {spl_A:.1f} dB | Z: {spl_Z:.1f} dB")
-                #print(f"{datetime.now().strftime('%H:%M:%S')} | LAeq: {LAeq:.1f} dB | A: {spl_A:.1f} dB | C: {spl_C:.1f} dB | Z: {spl_Z:.1f} dB")
-
-                freq_levels = band_analysis(measured_signal, 48000, factor)
-                round_levels = [round(val, 2) for val in freq_levels]
-                line = [LAeq] + round_levels + [spl_A, spl_C, spl_Z]
-
-                if save:
-                    save_complete_CSV(line, csv_file)
-                    complete_values = np.round(np.array(line) * 10).astype(np.int16)
-                    timestamp = np.asarray([time.time()], dtype=np.float64)
-                    with open(bin_file, "ab") as fbin:
-                        fbin.write(timestamp.tobytes())
-                        fbin.write(complete_values.tobytes())
-
-            else:
-                print("Not enough data.")
-
-            i += 1
+        while pipeline.is_alive():
+            time.sleep(1)
+            # Read by LaunchServer for /metrics
+            pipeline.update_metrics()
+            stats.publish(pipeline.metrics)
 
     except KeyboardInterrupt:
         print("\n Measurement stopped.")
         stream.stop()
         stream.close()
+        pipeline.stop()
+        print(f" Blocks processed: {pipeline.processed_blocks}, records written: {pipeline.written_records}, "
+              f"dropped: {pipeline.dropped_records}, overruns: {BUFFER.overruns}")
+    finally:
+        stats.close()
 
 
 if __name__ == "__main__":
@@ -311,5 +1290,6 @@ if __name__ == "__main__":
         type_temp="Fast",        
         recalibrate=False,        
         range="medium",          
-        save=True         
-    )
\ No newline at end of file
+        save=True,
+        channels=1
+    )
@@ -0,0 +1,226 @@
+# Binary measurement files (mesures_*.bin)
+#
+# Version 2 layout:
+#   MAGIC (8 bytes) | version (uint16) | JSON length (uint32) | JSON metadata
+#   then fixed-size records: timestamp (float64) | values (int16 x N) | crc32 (uint32)
+# Values are levels multiplied by "scale" (0.1 dB resolution). The crc covers
+# the timestamp and the values, so a torn or corrupted record is detected and
+# skipped. Record i starts at header_size + i * record_size.
+#
+# Version 1 (legacy) files have no header: timestamp (float64) + 35 int16.
+#
+# Other record layouts (e.g. the rollup sidecars) list their "fields" in the
+# metadata; the crc32 is then appended as the last field.
+#
+# Command line:
+#   python measure_format.py scan FILE [FILE ...]
+#   python measure_format.py recover FILE [FILE ...]
+
+import os
+import sys
+import json
+import struct
+import zlib
+import numpy as np
+
+MAGIC = b"SNDMETER"
+FORMAT_VERSION = 2
+PREAMBLE = struct.Struct("<8sHI")
+SCALE = 10
+
+LEGACY_BANDS = [
+    20, 25, 31.5, 40, 50, 63, 80, 100, 125, 160, 200, 250, 315,
+    400, 500, 630, 800, 1000, 1250, 1600, 2000, 2500, 3150,
+    4000, 5000, 6300, 8000, 10000, 12500, 16000, 20000
+]
+
+def default_columns(bands=LEGACY_BANDS):
+    return ["LAeq"] + [f"{int(f)}Hz" for f in bands] + ["SPL_A", "SPL_C", "SPL_Z"]
+
+LEGACY_METADATA = {
+    "version": 1,
+    "columns": default_columns(LEGACY_BANDS),
+    "bands_hz": LEGACY_BANDS,
+    "scale": SCALE,
+    "sample_rate": 48000,
+    "record_interval": 1.0,
+    "checksum": False,
+}
+
+def record_dtype(n_values, checksum=True):
+    fields = [("timestamp", "<f8"), ("values", "<i2", (n_values,))]
+    if checksum:
+        fields.append(("crc", "<u4"))
+    return np.dtype(fields)
+
+def metadata_dtype(metadata):
+    if "fields" in metadata:
+        fields = [(name, fmt, tuple(shape)) for name, fmt, shape in metadata["fields"]]
+        if metadata.get("checksum", True):
+            fields.append(("crc", "<u4"))
+        return np.dtype(fields)
+    return record_dtype(len(metadata["columns"]), metadata.get("checksum", True))
+
+def build_header(metadata):
+    meta = dict(metadata, version=FORMAT_VERSION, checksum=True)
+    payload = json.dumps(meta).encode("utf-8")
+    return PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(payload)) + payload
+
+def read_header(f):
+    """Return (metadata, header_size). Files without the magic are read as legacy version 1."""
+    f.seek(0)
+    preamble = f.read(PREAMBLE.size)
+    if len(preamble) < PREAMBLE.size or preamble[:len(MAGIC)] != MAGIC:
+        return dict(LEGACY_METADATA), 0
+    _, version, length = PREAMBLE.unpack(preamble)
+    if version > FORMAT_VERSION:
+        raise ValueError(f"Unsupported measurement file version {version}")
+    payload = f.read(length)
+    if len(payload) < length:
+        raise ValueError("Truncated measurement file header")
+    return json.loads(payload.decode("utf-8")), PREAMBLE.size + length
+
+def encode_record(timestamp, values, dtype):
+    record = np.zeros(1, dtype=dtype)
+    record["timestamp"] = timestamp
+    record["values"] = values
+    if "crc" in dtype.names:
+        body = record.tobytes()[:-4]
+        record["crc"] = zlib.crc32(body)
+    return record.tobytes()
+
+def encode_records(timestamps, values, dtype):
+    records = np.zeros(len(timestamps), dtype=dtype)
+    records["timestamp"] = timestamps
+    records["values"] = values
+    if "crc" in dtype.names:
+        raw = records.view(np.uint8).reshape(len(records), dtype.itemsize)
+        records["crc"] = [zlib.crc32(row[:-4].tobytes()) for row in raw]
+    return records.tobytes()
+
+def encode_structured(records):
+    """Fill the crc of already built records (any layout ending with crc) and return their bytes."""
+    raw = records.view(np.uint8).reshape(len(records), records.dtype.itemsize)
+    records["crc"] = [zlib.crc32(row[:-4].tobytes()) for row in raw]
+    return records.tobytes()
+
+def checksum_ok(records):
+    """Boolean mask of records whose crc matches (all True for legacy records)."""
+    if records.dtype.names is None or "crc" not in records.dtype.names:
+        return np.ones(len(records), dtype=bool)
+    raw = np.ascontiguousarray(records).view(np.uint8).reshape(len(records), records.dtype.itemsize)
+    crcs = np.fromiter((zlib.crc32(row[:-4].tobytes()) for row in raw), dtype=np.uint32, count=len(records))
+    return crcs == records["crc"]
+
+def read_records(path, validate=True):
+    """Return (metadata, records). The torn tail and, if validate, records with a bad crc are left out."""
+    with open(path, "rb") as f:
+        metadata, header_size = read_header(f)
+    dtype = metadata_dtype(metadata)
+    size = os.path.getsize(path)
+    count = max(0, (size - header_size) // dtype.itemsize)
+    records = np.fromfile(path, dtype=dtype, count=count, offset=header_size)
+    if validate:
+        records = records[checksum_ok(records)]
+    return metadata, records
+
+def read_last_record(path, max_back=16):
+    """Return (metadata, record) for the last valid record of the file, record is None if there is none."""
+    with open(path, "rb") as f:
+        metadata, header_size = read_header(f)
+        dtype = metadata_dtype(metadata)
+        f.seek(0, os.SEEK_END)
+        count = (f.tell() - header_size) // dtype.itemsize
+        for i in range(count - 1, max(-1, count - 1 - max_back), -1):
+            f.seek(header_size + i * dtype.itemsize)
+            record = np.frombuffer(f.read(dtype.itemsize), dtype=dtype)
+            if checksum_ok(record)[0]:
+                return metadata, record[0]
+    return metadata, None
+
+def decode_values(records, metadata):
+    return records["values"] / float(metadata.get("scale", SCALE))
+
+def prepare_for_append(path, metadata):
+    """
+    Get a file ready to receive records with the given metadata and return its path.
+    A new file gets the header; an existing one has its torn tail cut so new
+    records stay aligned. If the existing file is legacy or has other columns,
+    a sibling file (_v2, _v2_1, ...) is used instead.
+    """
+    candidate = path
+    root, ext = os.path.splitext(path)
+    attempt = 0
+    while True:
+        if not os.path.exists(candidate) or os.path.getsize(candidate) == 0:
+            with open(candidate, "wb") as f:
+                f.write(build_header(metadata))
+            return candidate
+        with open(candidate, "rb") as f:
+            existing, header_size = read_header(f)
+        if existing.get("version") == FORMAT_VERSION and existing["columns"] == list(metadata["columns"]) \
+                and existing.get("fields") == metadata.get("fields"):
+            record_size = metadata_dtype(existing).itemsize
+            size = os.path.getsize(candidate)
+            torn = (size - header_size) % record_size
+            if torn:
+                with open(candidate, "r+b") as f:
+                    f.truncate(size - torn)
+            return candidate
+        candidate = f"{root}_v2{ext}" if attempt == 0 else f"{root}_v2_{attempt}{ext}"
+        attempt += 1
+
+def scan_file(path):
+    """Summary of a measurement file: valid, corrupted and torn-tail records, time span."""
+    with open(path, "rb") as f:
+        metadata, header_size = read_header(f)
+    dtype = metadata_dtype(metadata)
+    size = os.path.getsize(path)
+    count = max(0, (size - header_size) // dtype.itemsize)
+    records = np.fromfile(path, dtype=dtype, count=count, offset=header_size)
+    ok = checksum_ok(records)
+    times = records["timestamp"][ok]
+    return {
+        "path": path,
+        "version": metadata.get("version"),
+        "records": int(ok.sum()),
+        "bad_checksum": int((~ok).sum()),
+        "torn_bytes": int(size - header_size - count * dtype.itemsize),
+        "first": float(times.min()) if len(times) else None,
+        "last": float(times.max()) if len(times) else None,
+    }
+
+def recover_file(path):
+    """Rewrite a file keeping only its valid records (legacy files are upgraded to version 2)."""
+    metadata, records = read_records(path, validate=True)
+    meta = {k: v for k, v in metadata.items() if k not in ("version", "checksum")}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(build_header(meta))
+        if "fields" in meta:
+            f.write(encode_structured(records.copy()))
+        else:
+            dtype = record_dtype(len(meta["columns"]))
+            f.write(encode_records(records["timestamp"], records["values"], dtype))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return scan_file(path)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 2 or argv[0] not in ("scan", "recover"):
+        print("Usage: python measure_format.py scan|recover FILE [FILE ...]")
+        return 2
+    action = scan_file if argv[0] == "scan" else recover_file
+    for path in argv[1:]:
+        try:
+            info = action(path)
+            print(f"{path}: v{info['version']} | {info['records']} records | "
+                  f"{info['bad_checksum']} bad checksum | {info['torn_bytes']} torn bytes")
+        except Exception as e:
+            print(f"{path}: error : {e}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
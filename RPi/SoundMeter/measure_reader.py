@@ -0,0 +1,209 @@
+# Memory-mapped reader for the hourly measurement files (mesures_*.bin)
+#
+#   reader = MeasurementReader("/home/acoustic/Documents/Mesures/measurements")
+#   day = reader.day(date(2025, 11, 20))
+#   day.timestamps, day.laeq, day.bands, day.spl("SPL_A")
+#
+# Each file is mapped as a NumPy structured array (see measure_format), time
+# ranges are found by binary search on the timestamp column and the selected
+# records stay views on the mapped files until a column is asked for.
+# Compacted days (mesures_<date>.sma, see archive.py) are read through their
+# block index, only the blocks of the requested range are decompressed.
+
+import os
+import glob
+import re
+from datetime import datetime, date, timedelta
+import numpy as np
+import measure_format
+import archive
+
+HOUR_PATTERN = re.compile(r"_(\d{4}-\d{2}-\d{2})_(\d{2})")
+DAY_PATTERN = re.compile(r"_(\d{4}-\d{2}-\d{2})\.sma$")
+
+def to_timestamp(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day).timestamp()
+    return float(value)
+
+class MeasurementFile:
+    """One measurement file mapped read-only; the torn tail, if any, is left out."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.metadata, self.header_size = measure_format.read_header(f)
+        self.columns = list(self.metadata["columns"])
+        self.scale = float(self.metadata.get("scale", measure_format.SCALE))
+        self.dtype = measure_format.metadata_dtype(self.metadata)
+        self.size = os.path.getsize(path)
+        count = max(0, (self.size - self.header_size) // self.dtype.itemsize)
+        if count:
+            self.records = np.memmap(path, dtype=self.dtype, mode="r", offset=self.header_size, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def timestamps(self):
+        return self.records["timestamp"]
+
+    def time_span(self):
+        if not len(self.records):
+            return None, None
+        return float(self.records["timestamp"][0]), float(self.records["timestamp"][-1])
+
+    def select(self, start=None, end=None, validate=False):
+        """Records with start <= timestamp < end, as a view unless validate drops bad checksums."""
+        ts = self.records["timestamp"]
+        lo = 0 if start is None else int(np.searchsorted(ts, start, side="left"))
+        hi = len(ts) if end is None else int(np.searchsorted(ts, end, side="left"))
+        part = self.records[lo:hi]
+        if validate and len(part):
+            ok = measure_format.checksum_ok(part)
+            if not ok.all():
+                part = part[ok]
+        return part
+
+class MeasurementSeries:
+    """
+    Records of a time range spread over several files.
+    The parts stay views on the mapped files; columns are concatenated (and
+    scaled to dB) only when asked for.
+    """
+
+    def __init__(self, parts, columns, scale=measure_format.SCALE):
+        self.parts = [p for p in parts if len(p)]
+        self.columns = list(columns)
+        self.scale = float(scale)
+
+    def __len__(self):
+        return sum(len(p) for p in self.parts)
+
+    def _concat(self, arrays, empty_shape, dtype):
+        if not arrays:
+            return np.zeros(empty_shape, dtype=dtype)
+        return arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+
+    @property
+    def timestamps(self):
+        return self._concat([p["timestamp"] for p in self.parts], (0,), np.float64)
+
+    def raw_views(self, name):
+        """int16 views (one per file) of a column, no copy."""
+        idx = self.columns.index(name)
+        return [p["values"][:, idx] for p in self.parts]
+
+    def column(self, name):
+        return self._concat(self.raw_views(name), (0,), np.int16) / self.scale
+
+    def columns_block(self, names):
+        idx = [self.columns.index(n) for n in names]
+        arrays = [p["values"][:, idx] for p in self.parts]
+        return self._concat(arrays, (0, len(idx)), np.int16) / self.scale
+
+    @property
+    def band_columns(self):
+        return [c for c in self.columns if c.endswith("Hz")]
+
+    @property
+    def freqs_hz(self):
+        return np.array([float(c[:-2]) for c in self.band_columns])
+
+    @property
+    def laeq(self):
+        return self.column("LAeq")
+
+    @property
+    def bands(self):
+        return self.columns_block(self.band_columns)
+
+    def spl(self, name="SPL_A"):
+        return self.column(name)
+
+class MeasurementReader:
+    """
+    Time-indexed access to the hourly .bin files of one directory.
+    Files are chosen from the date/hour in their names, then narrowed by
+    binary search on their timestamps. Mapped files are cached and re-mapped
+    when they grow (the current hour is still being written).
+    """
+
+    def __init__(self, directory, prefix="mesures", validate=False):
+        self.directory = directory
+        self.prefix = prefix
+        self.validate = validate
+        self.cache = {}
+
+    def paths(self):
+        pattern = os.path.join(self.directory, f"{self.prefix}_[0-9][0-9][0-9][0-9]-*")
+        paths = sorted(p for p in glob.glob(pattern) if p.endswith((".bin", archive.ARCHIVE_EXT)))
+        # Hourly files of an archived day (compact --keep-hourly) hold copies of its records
+        archived = set()
+        for path in paths:
+            match = DAY_PATTERN.search(os.path.basename(path))
+            if match:
+                archived.add(match.group(1))
+        selected = []
+        for path in paths:
+            match = HOUR_PATTERN.search(os.path.basename(path)[len(self.prefix):])
+            if path.endswith(".bin") and match and match.group(1) in archived:
+                continue
+            selected.append(path)
+        return selected
+
+    def open(self, path):
+        mf = self.cache.get(path)
+        if mf is None or os.path.getsize(path) != mf.size:
+            mf = archive.ArchiveFile(path) if path.endswith(archive.ARCHIVE_EXT) else MeasurementFile(path)
+            self.cache[path] = mf
+        return mf
+
+    def candidate_paths(self, start, end):
+        selected = []
+        for path in self.paths():
+            name = os.path.basename(path)[len(self.prefix):]
+            match = HOUR_PATTERN.search(name)
+            day = DAY_PATTERN.search(name)
+            if day:
+                day_start = datetime.strptime(day.group(1), "%Y-%m-%d").timestamp()
+                if (end is not None and day_start - 3600 >= end) or \
+                   (start is not None and day_start + 25 * 3600 <= start):
+                    continue
+            elif match:
+                hour_start = datetime.strptime(f"{match.group(1)} {match.group(2)}", "%Y-%m-%d %H").timestamp()
+                # One hour of slack on each side for records stamped across the boundary
+                if (end is not None and hour_start - 3600 >= end) or \
+                   (start is not None and hour_start + 2 * 3600 <= start):
+                    continue
+            selected.append(path)
+        return selected
+
+    def between(self, start=None, end=None):
+        """Records with start <= timestamp < end (datetimes, dates or epoch seconds)."""
+        start, end = to_timestamp(start), to_timestamp(end)
+        parts, columns, scale = [], None, measure_format.SCALE
+        for path in self.candidate_paths(start, end):
+            try:
+                mf = self.open(path)
+            except (OSError, ValueError) as e:
+                print(f"Skipping {path} : {e}")
+                continue
+            if columns is None:
+                columns, scale = mf.columns, mf.scale
+            elif mf.columns != columns:
+                print(f"Skipping {path} : columns differ from the other files")
+                continue
+            parts.append(mf.select(start, end, self.validate))
+        parts.sort(key=lambda p: p["timestamp"][0] if len(p) else 0.0)
+        return MeasurementSeries(parts, columns or measure_format.default_columns(), scale)
+
+    def day(self, day):
+        start = datetime(day.year, day.month, day.day)
+        return self.between(start, start + timedelta(days=1))
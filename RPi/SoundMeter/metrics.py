@@ -0,0 +1,181 @@
+# Run-time metrics of measure.py, exported by LaunchServer as /metrics
+#
+# measure.py counts events (audio callback status flags, ring buffer
+# overruns, dropped records), times the DSP and writer stages into
+# histograms and samples a few gauges (buffer depth, clock drift). Once per
+# second the main loop dumps everything as JSON into a small stats file in
+# /dev/shm (replaced atomically); the web server reads that file and renders
+# it in the Prometheus text format, so the measurement process never serves
+# requests itself.
+
+import os
+import json
+import time
+import bisect
+import threading
+import live_frame
+
+# name: (type, help); counters end in _total as Prometheus expects
+DEFINITIONS = {
+    "soundmeter_blocks_processed_total": ("counter", "One-second blocks processed by the DSP"),
+    "soundmeter_records_written_total": ("counter", "Records handed to the file writers"),
+    "soundmeter_records_dropped_total": ("counter", "Records dropped because the writer queue was full"),
+    "soundmeter_dsp_errors_total": ("counter", "Blocks whose processing raised an error"),
+    "soundmeter_write_errors_total": ("counter", "Records that could not be saved"),
+    "soundmeter_callback_status_total": ("counter", "Audio callbacks reporting a status flag, by flag"),
+    "soundmeter_ring_overruns_total": ("counter", "Audio chunks dropped because the ring buffer was full"),
+    "soundmeter_ring_dropped_samples_total": ("counter", "Samples lost in ring buffer overruns"),
+    "soundmeter_ring_underruns_total": ("counter", "Times the DSP found no complete block (stream stalled)"),
+    "soundmeter_ring_depth_seconds": ("gauge", "Audio waiting in the ring buffer"),
+    "soundmeter_record_queue_depth": ("gauge", "Records waiting for the writer thread"),
+    "soundmeter_clock_drift_seconds": ("gauge", "System clock minus sample clock at the last audio callback"),
+    "soundmeter_clock_resyncs_total": ("counter", "Whole-second forward steps of the sample clock"),
+    "soundmeter_clock_rate_error_ppm": ("gauge", "Sample rate of the ADC measured against the system clock, relative to the nominal one"),
+    "soundmeter_channels": ("gauge", "Channels measured"),
+    "soundmeter_events_total": ("counter", "Triggered audio events, by result (written, rate_limited, dropped_...)"),
+    "soundmeter_stage_seconds": ("histogram", "Processing time per one-second block, by stage"),
+    "soundmeter_dsp_lateness_seconds": ("histogram", "Audio already waiting behind a block when the DSP takes it"),
+    "soundmeter_flush_seconds": ("histogram", "Duration of the file flushes, with or without fsync"),
+}
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+LATENESS_BUCKETS = (0.0, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0)
+CALLBACK_FLAGS = ("input_overflow", "input_underflow", "output_overflow", "output_underflow", "priming_output")
+STALE_AFTER = 5.0
+
+def default_path():
+    return live_frame.shm_path("soundmeter_stats.json")
+
+def label_key(labels):
+    """Prometheus label text, e.g. 'stage="dsp"', which is also the key of the series."""
+    return ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+
+class Histogram:
+    """Counts per bucket (upper bounds, + Inf), with the sum and count of the observations."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self):
+        return {"buckets": list(self.buckets), "counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+class Metrics:
+    """
+    Counters, gauges and histograms keyed by name and labels. Updates from
+    the audio callback, DSP and writer threads and the snapshot from the
+    main loop go through one lock, held for a few dict operations only.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            series = self.values.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values.setdefault(name, {})[label_key(labels)] = value
+
+    def observe(self, name, value, buckets=STAGE_BUCKETS, **labels):
+        key = label_key(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "timestamp": time.time(),
+                "pid": os.getpid(),
+                "values": {name: dict(series) for name, series in self.values.items()},
+                "histograms": {name: {key: h.to_dict() for key, h in series.items()}
+                               for name, series in self.histograms.items()},
+            }
+
+class StatsPublisher:
+    """Writes the snapshot of a Metrics to the stats file, replaced atomically."""
+
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        self.tmp_path = f"{self.path}.{os.getpid()}"
+
+    def publish(self, metrics):
+        try:
+            with open(self.tmp_path, "w") as f:
+                json.dump(metrics.snapshot(), f)
+            os.replace(self.tmp_path, self.path)
+        except OSError as e:
+            print(f"Error while writing the stats file : {e}")
+
+    def close(self):
+        # No file means no measurement running, see render_prometheus
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def read_stats(path=None):
+    """Last snapshot published by measure.py, None if there is none."""
+    try:
+        with open(path or default_path(), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _series(name, key, value, extra=""):
+    labels = ",".join(part for part in (key, extra) if part)
+    return f"{name}{{{labels}}} {_number(value)}" if labels else f"{name} {_number(value)}"
+
+def render_prometheus(snapshot, now=None, stale_after=STALE_AFTER):
+    """Snapshot (or None) in the Prometheus text exposition format."""
+    now = time.time() if now is None else now
+    up = snapshot is not None and now - snapshot["timestamp"] <= stale_after
+    lines = ["# HELP soundmeter_up Whether measure.py published its statistics recently",
+             "# TYPE soundmeter_up gauge",
+             f"soundmeter_up {int(up)}"]
+    if snapshot is None:
+        return "\n".join(lines) + "\n"
+    lines += ["# HELP soundmeter_stats_age_seconds Time since the last statistics update",
+              "# TYPE soundmeter_stats_age_seconds gauge",
+              f"soundmeter_stats_age_seconds {_number(round(now - snapshot['timestamp'], 3))}"]
+
+    for name, (kind, help_text) in DEFINITIONS.items():
+        if kind == "histogram":
+            series = snapshot["histograms"].get(name)
+        else:
+            series = snapshot["values"].get(name)
+        if not series:
+            continue
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        for key, value in sorted(series.items()):
+            if kind != "histogram":
+                lines.append(_series(name, key, value))
+                continue
+            cumulative = 0
+            for bound, count in zip(value["buckets"] + [float("inf")], value["counts"]):
+                cumulative += count
+                lines.append(_series(f"{name}_bucket", key, cumulative, f'le="{_number(float(bound))}"'))
+            lines.append(_series(f"{name}_sum", key, value["sum"]))
+            lines.append(_series(f"{name}_count", key, value["count"]))
+    return "\n".join(lines) + "\n"
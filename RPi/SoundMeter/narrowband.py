@@ -0,0 +1,244 @@
+# Narrowband (FFT) spectra and tonal audibility
+#
+# NarrowbandAnalyzer turns the one-second blocks of measure.py into averaged
+# power spectra (Welch): Hann-windowed segments of NFFT samples with 50 %
+# overlap carried over from one block to the next, powers summed until the
+# averaging interval closes. The window, segment, rfft output and power
+# buffers are allocated once. Intervals are aligned on local midnight.
+#
+# Each averaged spectrum goes through the tonal audibility assessment of
+# ISO 1996-2 Annex C (engineering method):
+#   critical band       dfc = 25 + 75 (1 + 1.4 (f / 1000)^2)^0.69 Hz around the tone
+#   tone level Lpt      energy sum of the lines of the tones in the critical band
+#   masking level Lpn   mean power of the other lines of the band (away from the
+#                       tones' side lobes) x dfc / line spacing
+#   audibility dLta     Lpt - Lpn + 2 + log10(1 + (f / 502)^2.5)
+#   adjustment Kt       0 under 4 dB, dLta - 4 up to 10 dB, 6 dB above
+# The lines are scaled so that their sum is the mean square pressure, so a
+# tone's power is the sum of the lines of its window main lobe.
+#
+# One row per interval and channel is appended to
+#   tonality_<YYYY-mm-dd>.bin    (tonality_chN_... for channel N > 1)
+# in the measure_format "fields" layout: the interval, its Kt and the
+# MAX_TONES most audible tones (frequency, Lpt, Lpn, dLta; NaN when fewer).
+
+import os
+from datetime import datetime
+import numpy as np
+import measure_format
+import rollups
+
+NFFT = 16384            # 2.9 Hz lines at 48 kHz, under 5 % of the narrowest critical band
+OVERLAP = 0.5
+TONE_INTERVAL = 60
+TONE_FMIN = 20.0
+TONE_FMAX = 10000.0
+CANDIDATE_DB = 6.0      # a tone stands this far above the mean of its critical band
+MAX_CANDIDATES = 20
+MAX_TONES = 3
+MAINLOBE = 2            # Hann main lobe: the peak line +/- 2 lines
+NOISE_GUARD = 6         # lines around a tone left out of the masking noise (side lobes)
+P0_SQUARED = (20e-6)**2
+TONE_COLUMNS = ["frequency", "tone_level", "masking_level", "audibility"]
+
+try:
+    np.fft.rfft(np.zeros(4), out=np.zeros(3, dtype=complex))
+    RFFT_OUT = True
+except TypeError:
+    # numpy < 2.0 has no out= on the fft functions
+    RFFT_OUT = False
+
+def critical_bandwidth(f):
+    return 25 + 75 * (1 + 1.4 * (np.asarray(f) / 1000)**2)**0.69
+
+def audibility_adjustment(audibility):
+    """Kt of ISO 1996-2 Annex C from the audibility dLta."""
+    return np.clip(np.asarray(audibility, dtype=np.float64) - 4, 0, 6)
+
+def find_tones(freqs, power, fmin=TONE_FMIN, fmax=TONE_FMAX, max_candidates=MAX_CANDIDATES):
+    """
+    Tones of one averaged spectrum (line powers in Pa^2), most audible first:
+    [{"frequency", "tone_level", "masking_level", "audibility", "kt"}].
+    """
+    df = freqs[1] - freqs[0]
+    n = len(power)
+    cum = np.concatenate(([0.0], np.cumsum(power)))
+    half = critical_bandwidth(freqs) / 2
+    lo = np.searchsorted(freqs, freqs - half)
+    hi = np.searchsorted(freqs, freqs + half, side="right")
+    band_mean = (cum[hi] - cum[lo]) / (hi - lo)
+
+    # Local maxima over the main lobe, whose power stands out of their critical band
+    k = np.arange(MAINLOBE, n - MAINLOBE)
+    peak = np.ones(len(k), dtype=bool)
+    for d in range(1, MAINLOBE + 1):
+        peak &= (power[k] >= power[k - d]) & (power[k] > power[k + d])
+    k = k[peak & (freqs[k] >= fmin) & (freqs[k] <= fmax)]
+    tone_power = cum[k + MAINLOBE + 1] - cum[k - MAINLOBE]
+    ratio = tone_power / ((2 * MAINLOBE + 1) * band_mean[k])
+    keep = ratio > 10**(CANDIDATE_DB / 10)
+    k, tone_power = k[keep], tone_power[keep]
+    order = np.argsort(tone_power)[::-1][:max_candidates]
+    k, tone_power = k[order], tone_power[order]
+
+    tones = []
+    for line in k:
+        f = freqs[line]
+        in_band = np.abs(freqs[k] - f) <= half[line]
+        noise = np.ones(hi[line] - lo[line], dtype=bool)
+        for other in k[in_band]:
+            noise[max(0, other - NOISE_GUARD - lo[line]):max(0, other + NOISE_GUARD + 1 - lo[line])] = False
+        if not noise.any():
+            continue
+        noise_line = power[lo[line]:hi[line]][noise].mean()
+        Lpt = 10 * np.log10(tone_power[in_band].sum() / P0_SQUARED)
+        Lpn = 10 * np.log10(noise_line * 2 * half[line] / df / P0_SQUARED)
+        audibility = Lpt - Lpn + 2 + np.log10(1 + (f / 502)**2.5)
+        tones.append({
+            "frequency": float(f),
+            "tone_level": float(Lpt),
+            "masking_level": float(Lpn),
+            "audibility": float(audibility),
+            "kt": float(audibility_adjustment(audibility)),
+        })
+    tones.sort(key=lambda t: t["audibility"], reverse=True)
+    return tones
+
+class NarrowbandAnalyzer:
+    """
+    Streaming Welch spectra of (channels, samples) blocks. add() returns the
+    result of the previous interval (see close) when a block starts a new one.
+    """
+
+    def __init__(self, sample_rate, channels=1, factor=1.0, interval=TONE_INTERVAL, nfft=NFFT, overlap=OVERLAP):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.factor = np.broadcast_to(np.asarray(factor, dtype=np.float64), (channels,))
+        self.interval = interval
+        self.nfft = nfft
+        self.hop = int(nfft * (1 - overlap))
+        self.window = np.hanning(nfft + 1)[:-1]     # periodic Hann
+        # Lines sum to the mean square of the segment
+        self.scale = 2.0 / (nfft * np.sum(self.window**2))
+        self.freqs = np.fft.rfftfreq(nfft, 1.0 / sample_rate)
+        self.pending = np.zeros((channels, nfft + sample_rate))
+        self.filled = 0
+        self.segment = np.empty((channels, nfft))
+        self.spectrum = np.empty((channels, len(self.freqs)), dtype=complex)
+        self.square = np.empty((channels, len(self.freqs)))
+        self.power_sum = np.zeros((channels, len(self.freqs)))
+        self.segments = 0
+        self.blocks = 0
+        self.start = None
+        self.end = None
+
+    def add(self, block, timestamp):
+        """block (channels, samples) ends at timestamp."""
+        n = block.shape[-1]
+        middle = timestamp - n / (2 * self.sample_rate)
+        result = None
+        if self.start is None or not (self.start <= middle < self.end):
+            result = self.close()
+            self.start, self.end = rollups.interval_bounds(middle, self.interval)
+        self._feed(block)
+        self.blocks += 1
+        return result
+
+    def _feed(self, block):
+        n = block.shape[-1]
+        if self.filled + n > self.pending.shape[-1]:
+            grown = np.zeros((self.channels, self.nfft + n))
+            grown[:, :self.filled] = self.pending[:, :self.filled]
+            self.pending = grown
+        self.pending[:, self.filled:self.filled + n] = block
+        self.filled += n
+        pos = 0
+        while pos + self.nfft <= self.filled:
+            np.multiply(self.pending[:, pos:pos + self.nfft], self.window, out=self.segment)
+            if RFFT_OUT:
+                np.fft.rfft(self.segment, axis=-1, out=self.spectrum)
+            else:
+                self.spectrum[...] = np.fft.rfft(self.segment, axis=-1)
+            np.multiply(self.spectrum.real, self.spectrum.real, out=self.square)
+            self.power_sum += self.square
+            np.multiply(self.spectrum.imag, self.spectrum.imag, out=self.square)
+            self.power_sum += self.square
+            self.segments += 1
+            pos += self.hop
+        # The overlap (and anything short of a segment) waits for the next block
+        rest = self.filled - pos
+        self.pending[:, :rest] = self.pending[:, pos:self.filled]
+        self.filled = rest
+
+    def power(self):
+        """Averaged line powers in Pa^2, (channels, lines)."""
+        return self.power_sum / max(self.segments, 1) * self.scale * self.factor[:, None]**2
+
+    def close(self):
+        """
+        {"start", "duration", "blocks", "segments", "power", "tones": one list
+        per channel} of the interval in progress (None if it has no complete
+        segment); the averages start again from zero. The overlap buffer is
+        kept, the stream goes on.
+        """
+        result = None
+        if self.segments:
+            power = self.power()
+            result = {
+                "start": self.start,
+                "duration": self.interval,
+                "blocks": self.blocks,
+                "segments": self.segments,
+                "power": power,
+                "tones": [find_tones(self.freqs, p) for p in power],
+            }
+        self.power_sum[...] = 0
+        self.segments = 0
+        self.blocks = 0
+        return result
+
+def tonality_metadata(interval, nfft, sample_rate):
+    return {
+        "columns": TONE_COLUMNS,
+        "fields": [
+            ["timestamp", "<f8", []],
+            ["duration", "<f4", []],
+            ["blocks", "<u4", []],
+            ["kt", "<f4", []],
+        ] + [[name, "<f4", [MAX_TONES]] for name in TONE_COLUMNS],
+        "interval": interval,
+        "nfft": nfft,
+        "sample_rate": sample_rate,
+        "method": "ISO 1996-2 Annex C",
+    }
+
+class TonalityWriter:
+    """Rows of one channel, appended to the daily tonality files as intervals close."""
+
+    def __init__(self, meas_dir, interval, nfft=NFFT, sample_rate=48000, prefix="tonality"):
+        self.meas_dir = meas_dir
+        self.prefix = prefix
+        self.metadata = tonality_metadata(interval, nfft, sample_rate)
+        self.dtype = measure_format.metadata_dtype(self.metadata)
+
+    def row(self, result, tones):
+        row = np.zeros(1, dtype=self.dtype)
+        row["timestamp"] = result["start"]
+        row["duration"] = result["duration"]
+        row["blocks"] = result["blocks"]
+        row["kt"] = tones[0]["kt"] if tones else 0.0
+        for name in TONE_COLUMNS:
+            values = np.full(MAX_TONES, np.nan)
+            values[:len(tones[:MAX_TONES])] = [t[name] for t in tones[:MAX_TONES]]
+            row[name] = values
+        return row
+
+    def write(self, result, tones):
+        day = datetime.fromtimestamp(result["start"]).strftime("%Y-%m-%d")
+        try:
+            path = measure_format.prepare_for_append(
+                os.path.join(self.meas_dir, f"{self.prefix}_{day}.bin"), self.metadata)
+            with open(path, "ab") as f:
+                f.write(measure_format.encode_structured(self.row(result, tones)))
+        except Exception as e:
+            print(f"Error while saving tonality : {e}")
@@ -0,0 +1,192 @@
+# Offline replay of WAV recordings through the measure.py pipeline
+#
+#   python replay.py rec1.wav rec2.wav --out measurements [--start "2025-11-20 08:00:00"] [--workers 4]
+#
+# The recording goes through the same stages as the live measurement
+# (weighting, time weighting, third-octave bands, hourly CSV/.bin and rollup
+# writers), one-second blocks taken from large memory-mapped chunks, as fast
+# as the CPU allows. Records are stamped with the recording's timeline: the
+# end of each one-second block after the start time of the file, which is
+# --start, else a YYYYmmdd_HHMMSS / YYYY-mm-dd_HH-MM-SS stamp in the file
+# name, else the file modification time minus its duration.
+#
+# Several files are spread over a process pool. Each worker writes into its
+# own directory and the hourly files are merged into --out afterwards
+# (records sorted by time), so two recordings of the same hour never append
+# to one file at the same time.
+
+import os
+import re
+import sys
+import shutil
+import argparse
+import tempfile
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.io import wavfile
+import measure
+import measure_format
+
+CHUNK_SECONDS = 60
+NAME_STAMP = re.compile(r"(\d{4})-?(\d{2})-?(\d{2})[_T -]?(\d{2})[-:h]?(\d{2})[-:m]?(\d{2})")
+
+def to_float(samples):
+    """Samples as float32 in [-1, 1), like sounddevice delivers them."""
+    if samples.dtype == np.uint8:
+        return (samples.astype(np.float32) - 128) / 128
+    if samples.dtype.kind == "i":
+        return samples.astype(np.float32) / float(2 ** (8 * samples.dtype.itemsize - 1))
+    return samples.astype(np.float32)
+
+def recording_start(path, duration, start=None):
+    """Epoch time of the first sample (see the header of this file)."""
+    if start is not None:
+        return start.timestamp() if isinstance(start, datetime) else float(start)
+    match = NAME_STAMP.search(os.path.basename(path))
+    if match:
+        try:
+            return datetime(*(int(g) for g in match.groups())).timestamp()
+        except ValueError:
+            pass
+    return os.path.getmtime(path) - duration
+
+def replay_file(path, meas_dir, factor, type_temp="Fast", start=None, channels=None,
+                short_interval=None, band_interval=None, tone_interval=None):
+    """Process one WAV file into meas_dir; returns (records written, seconds of audio)."""
+    sample_rate, data = wavfile.read(path, mmap=True)
+    if data.ndim == 1:
+        data = data[:, None]
+    if channels is not None:
+        data = data[:, :channels]
+    n_channels = data.shape[1]
+    duration = len(data) / sample_rate
+    t0 = recording_start(path, duration, start)
+
+    pipeline = measure.MeasurementPipeline(
+        factor, type_temp=type_temp, save=True, meas_dir=meas_dir,
+        ring=measure.RingBuffer(1, channels=n_channels), sample_rate=sample_rate, verbose=False,
+        short_interval=short_interval, band_interval=band_interval, tone_interval=tone_interval)
+    chunk = CHUNK_SECONDS * sample_rate
+    n_blocks = len(data) // sample_rate
+    try:
+        for first in range(0, n_blocks * sample_rate, chunk):
+            samples = to_float(data[first:min(first + chunk, n_blocks * sample_rate)])
+            for offset in range(0, len(samples), sample_rate):
+                # Stamped at the end of the block, as the live measurement does
+                timestamp = t0 + (first + offset + sample_rate) / sample_rate
+                record = pipeline.process_block(samples[offset:offset + sample_rate], timestamp)
+                pipeline.write_record(*record)
+    finally:
+        pipeline.close_writers()
+    return pipeline.written_records, duration
+
+def _replay_worker(path, meas_dir, factor, type_temp, start, channels, short_interval, band_interval,
+                   tone_interval):
+    os.makedirs(meas_dir, exist_ok=True)
+    return replay_file(path, meas_dir, factor, type_temp, start, channels, short_interval, band_interval,
+                       tone_interval)
+
+def merge_csv(dest, sources):
+    header, lines = None, []
+    for path in [p for p in [dest] if os.path.exists(p)] + sources:
+        with open(path, "r", newline="") as f:
+            content = f.read().split("\r\n")
+        if header is None:
+            header = content[0]
+        lines.extend(line for line in content[1:] if line)
+    # "YYYY-mm-dd HH:MM:SS" first: sorting the text sorts by time
+    lines.sort(key=lambda line: line[:19])
+    tmp_path = dest + ".tmp"
+    with open(tmp_path, "w", newline="") as f:
+        f.write("".join(line + "\r\n" for line in [header] + lines))
+    os.replace(tmp_path, dest)
+
+def merge_bin(dest, sources):
+    metadata, parts = None, []
+    for path in [p for p in [dest] if os.path.exists(p)] + sources:
+        meta, records = measure_format.read_records(path)
+        if metadata is None:
+            metadata = meta
+        parts.append(records)
+    records = np.concatenate(parts)
+    records = records[np.argsort(records["timestamp"], kind="stable")]
+    meta = {k: v for k, v in metadata.items() if k not in ("version", "checksum")}
+    tmp_path = dest + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(measure_format.build_header(meta))
+        f.write(measure_format.encode_structured(records))
+    os.replace(tmp_path, dest)
+
+def merge_outputs(work_dirs, meas_dir):
+    """Move the files of the worker directories into meas_dir, merging files of the same name."""
+    names = {}
+    for work_dir in work_dirs:
+        for name in os.listdir(work_dir):
+            names.setdefault(name, []).append(os.path.join(work_dir, name))
+    for name, sources in sorted(names.items()):
+        dest = os.path.join(meas_dir, name)
+        if len(sources) == 1 and not os.path.exists(dest):
+            shutil.move(sources[0], dest)
+        elif name.endswith(".csv"):
+            merge_csv(dest, sources)
+        elif name.endswith(".bin"):
+            merge_bin(dest, sources)
+
+def replay(paths, meas_dir, factor, type_temp="Fast", start=None, channels=None, workers=None,
+           short_interval=None, band_interval=None, tone_interval=None):
+    """Replay WAV files into meas_dir; a single file is processed in this process."""
+    os.makedirs(meas_dir, exist_ok=True)
+    if len(paths) == 1:
+        written, duration = replay_file(paths[0], meas_dir, factor, type_temp, start, channels,
+                                        short_interval, band_interval, tone_interval)
+        print(f"{paths[0]} : {written} records ({duration:.0f} s of audio)")
+        return
+    if start is not None:
+        print("--start applies to a single file, the file names / dates are used instead")
+    tmp_root = tempfile.mkdtemp(prefix=".replay_", dir=meas_dir)
+    work_dirs = [os.path.join(tmp_root, str(i)) for i in range(len(paths))]
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_replay_worker, path, work_dir, factor, type_temp, None, channels,
+                                   short_interval, band_interval, tone_interval)
+                       for path, work_dir in zip(paths, work_dirs)]
+            for path, future in zip(paths, futures):
+                try:
+                    written, duration = future.result()
+                    print(f"{path} : {written} records ({duration:.0f} s of audio)")
+                except Exception as e:
+                    print(f"{path} : error : {e}")
+        merge_outputs([d for d in work_dirs if os.path.isdir(d)], meas_dir)
+    finally:
+        shutil.rmtree(tmp_root, ignore_errors=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay WAV recordings through the measurement pipeline")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--out", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "measurements"))
+    parser.add_argument("--start", help="start of the recording (YYYY-mm-dd HH:MM:SS), single file only")
+    parser.add_argument("--factor", type=float, help="calibration factor (Pa/unit), default: calibration.txt")
+    parser.add_argument("--time-weighting", default="Fast", choices=sorted(measure.TIME_CONSTANTS))
+    parser.add_argument("--channels", type=int, default=None, help="only the first N channels of the files")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--short-interval", type=float, default=None,
+                        help="also log short LAeq / LAFmax every N s (e.g. 0.1, 0.125)")
+    parser.add_argument("--band-interval", type=float, default=None, help="also log the bands every N s")
+    parser.add_argument("--tone-interval", type=float, default=None,
+                        help="narrowband spectra averaged over N s, checked for tones (e.g. 60)")
+    args = parser.parse_args(argv)
+
+    factor = args.factor
+    if factor is None:
+        factor, _ = measure.load_calibration()
+        if factor is None:
+            print("No calibration found, give --factor.")
+            return 1
+    start = datetime.strptime(args.start, "%Y-%m-%d %H:%M:%S") if args.start else None
+    replay(args.files, args.out, factor, args.time_weighting, start, args.channels, args.workers,
+           args.short_interval, args.band_interval, args.tone_interval)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+# Rollup sidecars written alongside the hourly measurement files
+#
+# For every resolution (1 min, 15 min, 1 h) measure.py keeps, per interval,
+# the number of 1 s records, the energy sums 10^(L/10) of LAeq,1s and of each
+# band, the max / min of LAeq,1s and, for 15 min and 1 h, a 0.1 dB histogram
+# of LAeq,1s. A row is appended when its interval closes, to
+#   rollup_<resolution>_<YYYY-mm-dd>.bin    (rollup_chN_... for channel N > 1)
+# in the measure_format layout. Rows only hold sums, counts and extrema, so
+# rows of the same interval (written before and after a restart) or of
+# consecutive intervals merge exactly with merge_rows().
+
+import os
+import glob
+from datetime import datetime
+import numpy as np
+import measure_format
+
+ROLLUP_INTERVALS = {"1min": 60, "15min": 900, "1h": 3600}
+HISTOGRAM_RESOLUTIONS = ("15min", "1h")
+HIST_STEP_DB = 0.1
+HIST_BINS = 1501    # 0.0 to 150.0 dB
+
+def level_bins(levels):
+    """Histogram bin of each level (0.1 dB steps, clipped to 0-150 dB)."""
+    idx = np.rint(np.asarray(levels, dtype=np.float64) / HIST_STEP_DB)
+    return np.clip(np.nan_to_num(idx, nan=0), 0, HIST_BINS - 1).astype(np.int64)
+
+def interval_bounds(timestamp, interval):
+    """(start, end) of the interval holding timestamp, intervals aligned on local midnight."""
+    midnight = datetime.fromtimestamp(timestamp).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+    start = midnight + ((timestamp - midnight) // interval) * interval
+    return start, start + interval
+
+def rollup_fields(n_columns, histogram):
+    fields = [
+        ["timestamp", "<f8", []],
+        ["duration", "<f4", []],
+        ["count", "<u4", []],
+        ["energy", "<f8", [n_columns]],
+        ["laeq_max", "<f4", []],
+        ["laeq_min", "<f4", []],
+    ]
+    if histogram:
+        fields.append(["hist", "<u2", [HIST_BINS]])
+    return fields
+
+def rollup_metadata(resolution, columns):
+    histogram = resolution in HISTOGRAM_RESOLUTIONS
+    return {
+        "columns": list(columns),
+        "fields": rollup_fields(len(columns), histogram),
+        "resolution": resolution,
+        "interval": ROLLUP_INTERVALS[resolution],
+        "hist_step_db": HIST_STEP_DB if histogram else None,
+    }
+
+class RollupAccumulator:
+    """
+    Sums of one resolution for the interval in progress.
+    add() returns the finished row when a record falls in a new interval.
+    Intervals are aligned on local midnight.
+    """
+
+    def __init__(self, resolution, columns, indices):
+        self.resolution = resolution
+        self.interval = ROLLUP_INTERVALS[resolution]
+        self.columns = list(columns)
+        self.indices = np.asarray(indices)
+        self.metadata = rollup_metadata(resolution, columns)
+        self.dtype = measure_format.metadata_dtype(self.metadata)
+        self.histogram = "hist" in self.dtype.names
+        self.start = None
+        self.end = None
+        self._reset()
+
+    def _reset(self):
+        self.count = 0
+        self.energy = np.zeros(len(self.columns))
+        self.laeq_max = -np.inf
+        self.laeq_min = np.inf
+        self.hist = np.zeros(HIST_BINS, dtype=np.uint16) if self.histogram else None
+
+    def add(self, timestamp, line):
+        row = None
+        if self.start is None or not (self.start <= timestamp < self.end):
+            row = self.close()
+            self.start, self.end = interval_bounds(timestamp, self.interval)
+        values = np.asarray(line, dtype=np.float64)[self.indices]
+        self.count += 1
+        self.energy += 10 ** (values / 10)
+        laeq = values[0]
+        self.laeq_max = max(self.laeq_max, laeq)
+        self.laeq_min = min(self.laeq_min, laeq)
+        if self.histogram:
+            self.hist[level_bins(laeq)] += 1
+        return row
+
+    def close(self):
+        """Row of the interval in progress (None if empty); the sums start again from zero."""
+        if not self.count:
+            return None
+        row = np.zeros(1, dtype=self.dtype)
+        row["timestamp"] = self.start
+        row["duration"] = self.interval
+        row["count"] = self.count
+        row["energy"] = self.energy
+        row["laeq_max"] = self.laeq_max
+        row["laeq_min"] = self.laeq_min
+        if self.histogram:
+            row["hist"] = self.hist
+        self._reset()
+        return row
+
+class RollupWriter:
+    """All resolutions of one channel, appended to the daily sidecar files as intervals close."""
+
+    def __init__(self, meas_dir, columns, prefix="rollup", resolutions=tuple(ROLLUP_INTERVALS)):
+        self.meas_dir = meas_dir
+        self.prefix = prefix
+        # LAeq and the band levels are rolled up, the SPL_x instant values are not
+        names = [c for c in columns if c == "LAeq" or c.endswith("Hz")]
+        indices = [list(columns).index(c) for c in names]
+        self.accumulators = {res: RollupAccumulator(res, names, indices) for res in resolutions}
+
+    def path(self, resolution, timestamp):
+        day = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
+        return os.path.join(self.meas_dir, f"{self.prefix}_{resolution}_{day}.bin")
+
+    def _append(self, resolution, row):
+        acc = self.accumulators[resolution]
+        try:
+            path = measure_format.prepare_for_append(self.path(resolution, row["timestamp"][0]), acc.metadata)
+            with open(path, "ab") as f:
+                f.write(measure_format.encode_structured(row))
+        except Exception as e:
+            print(f"Error while saving rollup : {e}")
+
+    def add(self, timestamp, line):
+        for resolution, acc in self.accumulators.items():
+            row = acc.add(timestamp, line)
+            if row is not None:
+                self._append(resolution, row)
+
+    def close(self):
+        # The interval in progress is written as a partial row; it merges with the rest later
+        for resolution, acc in self.accumulators.items():
+            row = acc.close()
+            if row is not None:
+                self._append(resolution, row)
+
+def read_rollups(directory, resolution="1h", start=None, end=None, prefix="rollup"):
+    """Return (metadata, rows) of one resolution with start <= timestamp < end (epoch seconds)."""
+    metadata, parts = None, []
+    for path in sorted(glob.glob(os.path.join(directory, f"{prefix}_{resolution}_*.bin"))):
+        try:
+            meta, rows = measure_format.read_records(path)
+        except (OSError, ValueError) as e:
+            print(f"Skipping {path} : {e}")
+            continue
+        if metadata is None:
+            metadata = meta
+        elif meta["columns"] != metadata["columns"]:
+            continue
+        if start is not None:
+            rows = rows[rows["timestamp"] >= start]
+        if end is not None:
+            rows = rows[rows["timestamp"] < end]
+        parts.append(rows)
+    if metadata is None:
+        return None, None
+    rows = np.concatenate(parts)
+    return metadata, rows[np.argsort(rows["timestamp"], kind="stable")]
+
+def merge_rows(rows, keys=None):
+    """
+    Merge rollup rows, all into one row or one row per distinct key (for
+    example a coarser interval start, or rows["timestamp"] to fold the
+    partial rows of a restart). Returns rows sorted by key.
+    """
+    if keys is None:
+        keys = np.zeros(len(rows))
+    unique, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.ravel()
+    # uint16 histograms are enough for one hour, not for a merged day
+    fields = [(n, "<u4", (HIST_BINS,)) if n == "hist" else (n, rows.dtype.fields[n][0])
+              for n in rows.dtype.names if n != "crc"]
+    merged = np.zeros(len(unique), dtype=fields)
+    first = np.full(len(unique), len(rows))
+    np.minimum.at(first, inverse, np.arange(len(rows)))
+    merged["timestamp"] = rows["timestamp"][first]
+    # Rows of the same interval (restarts) all carry the full interval: count it once
+    _, pair = np.unique(np.column_stack([inverse, rows["timestamp"]]), axis=0, return_inverse=True)
+    pair = pair.ravel()
+    span = np.zeros(pair.max() + 1 if len(pair) else 0)
+    np.maximum.at(span, pair, rows["duration"])
+    pair_key = np.zeros(len(span), dtype=np.int64)
+    pair_key[pair] = inverse
+    np.add.at(merged["duration"], pair_key, span)
+    np.add.at(merged["count"], inverse, rows["count"])
+    np.add.at(merged["energy"], inverse, rows["energy"])
+    merged["laeq_max"] = -np.inf
+    merged["laeq_min"] = np.inf
+    np.maximum.at(merged["laeq_max"], inverse, rows["laeq_max"])
+    np.minimum.at(merged["laeq_min"], inverse, rows["laeq_min"])
+    if "hist" in rows.dtype.names:
+        np.add.at(merged["hist"], inverse, rows["hist"])
+    return merged
+
+def leq(rows):
+    """Energy-average levels of each row, one column per rolled-up column (LAeq first)."""
+    count = np.asarray(rows["count"], dtype=np.float64)[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return 10 * np.log10(rows["energy"] / count)
@@ -14,5 +14,8 @@ cd "$PROJECT_DIR" || exit 1
 LOG_FILE="$PROJECT_DIR/daily_report_$(date +'%Y-%m-%d').log"
 python3 Report_And_Mail.py >> "$LOG_FILE" 2>&1
 
+# merge the closed days into compressed daily archives
+python3 archive.py compact >> "$LOG_FILE" 2>&1
+
 # keep only the last $LOG_KEEP logs
 ls -1t daily_report_*.log | tail -n +$((LOG_KEEP + 1)) | xargs -r rm --